@@ -1,30 +1,46 @@
 import os
 import cv2
 import numpy as np
-from flask import Flask, render_template, request, redirect, url_for, jsonify, flash, send_from_directory, send_file
+from flask import Flask, render_template, request, redirect, url_for, jsonify, flash, send_file, abort, session
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.security import generate_password_hash, check_password_hash, safe_join
+from werkzeug.serving import is_running_from_reloader
 from sqlalchemy import case as sql_case
 import json
 import base64
-from datetime import datetime
+from datetime import datetime, timedelta
 import uuid
 import logging
-from models import db, User, Case, Photo, Activity
+import threading
+from models import db, User, Case, Photo, Activity, IngestJob, EncodingMemo
 from utils.sms_service import send_match_notification
 from functools import wraps
+from contextlib import contextmanager
 import pandas as pd
 from reportlab.lib import colors
 from reportlab.lib.pagesizes import letter
 from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph
 from reportlab.lib.styles import getSampleStyleSheet
 import io
+import zipfile
 from flask_wtf import FlaskForm
 from wtforms import StringField, IntegerField, SelectField, DateField, MultipleFileField
 from wtforms.validators import DataRequired, NumberRange
 import secrets
+import click
 from flask_migrate import Migrate
-from utils.face_recognition import compare_faces
+from utils.face_recognition import match_many
+from routes.api import api as api_blueprint
+from utils.face_gallery import FaceGallery, encoding_to_bytes, decode_photo_encoding
+from utils.gallery_snapshot import save_snapshot, load_snapshot
+from utils.shared_gallery import SharedGallery
+from utils.ann_index import ANN_MIN_RECALL, IVFIndex, recall_against_exact
+from utils.encoding_service import EncodingService, EncodingServiceBusy
+from utils.face_tracking import FaceTracker
+from utils.image_io import atomic_write
+from utils.photo_store import PhotoStore, content_hash
+from utils.batch_archive import BatchTooLarge, UnsafeArchive, read_archive_images
+from concurrent.futures import TimeoutError as EncodingTimeout
 import face_recognition
 import pickle
 import time
@@ -33,8 +49,25 @@ import re
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key-here'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///missing_persons.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///missing_persons.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Largest request body accepted (batch scans and multi-photo cases included); Flask answers 413 past it
+app.config['MAX_CONTENT_LENGTH'] = 32 * 1024 * 1024
+# Face detector settings per pipeline. JPEGs are decoded at reduced resolution (longest
+# side between max_dimension and twice that) and encoded from those pixels; the detector
+# runs on a copy no larger than max_dimension. Boxes are reported in upload coordinates.
+app.config['SCAN_DETECTION'] = {'max_dimension': 640, 'upsample': 1, 'model': 'hog'}
+app.config['INGEST_DETECTION'] = {'max_dimension': 1024, 'upsample': 1, 'model': 'hog'}
+# Reject single-face and live-camera frames the Haar cascade finds no face in before running
+# dlib. Crowd and batch scans never use it: the frontal cascade drops small or turned faces.
+app.config['SCAN_HAAR_PREFILTER'] = True
+# Encoding worker processes (0 runs encoding inline), queue bound and per-image timeout in seconds
+app.config['ENCODING_WORKERS'] = min(4, os.cpu_count() or 1)
+app.config['ENCODING_QUEUE_SIZE'] = 32
+app.config['ENCODING_TIMEOUT'] = 30
+# Separate worker processes for queued case photos, so ingest batches never delay live scans
+# and a batch's photos are still encoded in parallel
+app.config['INGEST_ENCODING_WORKERS'] = min(4, os.cpu_count() or 1)
 
 # Initialize extensions
 db.init_app(app)
@@ -46,8 +79,14 @@ login_manager.login_view = 'login'
 logging.basicConfig(level=logging.DEBUG)
 app.logger.setLevel(logging.DEBUG)
 
+# Content-addressed storage for case photos
+PHOTO_STORE = PhotoStore()
+# Longest side in pixels of the cached photo variants served to pages
+PHOTO_VARIANTS = {'thumb': 160, 'medium': 640}
+PHOTO_MAX_AGE = 365 * 24 * 3600  # Photo names are content hashes, so responses never go stale
+
 # Create data directories if they don't exist
-os.makedirs('data/faces', exist_ok=True)
+os.makedirs(PHOTO_STORE.root, exist_ok=True)
 os.makedirs('data/encodings', exist_ok=True)
 os.makedirs('data/uploads', exist_ok=True)
 
@@ -59,33 +98,428 @@ USER_DATA_FILE = 'data/encodings/user_data.json'
 app.logger.info(f"Current working directory: {os.getcwd()}")
 app.logger.info(f"ENCODINGS_FILE path: {os.path.abspath(ENCODINGS_FILE)}")
 app.logger.info(f"USER_DATA_FILE path: {os.path.abspath(USER_DATA_FILE)}")
-app.logger.info(f"Faces directory: {os.path.abspath('data/faces')}")
+app.logger.info(f"Faces directory: {os.path.abspath(PHOTO_STORE.root)}")
+
+# Face detection and encoding run in worker processes, each with its own Haar cascade.
+# Scans and photo ingestion get separate pools: a FIFO shared with 16-photo ingest
+# batches would leave live scans waiting behind them.
+ENCODING_SERVICE = EncodingService(workers=app.config['ENCODING_WORKERS'],
+                                   max_pending=app.config['ENCODING_QUEUE_SIZE'],
+                                   timeout=app.config['ENCODING_TIMEOUT'])
+INGEST_ENCODING_SERVICE = EncodingService(workers=app.config['INGEST_ENCODING_WORKERS'],
+                                          max_pending=app.config['ENCODING_QUEUE_SIZE'],
+                                          timeout=app.config['ENCODING_TIMEOUT'])
+
+def encode_scan_image(data, max_faces=None):
+    """
+    Detect and encode a scanned image in the encoding pool. The Haar
+    prefilter only gates single-face scans (max_faces=1).
+    """
+    return ENCODING_SERVICE.encode(data, app.config['SCAN_DETECTION'],
+                                   prefilter=app.config['SCAN_HAAR_PREFILTER'] and max_faces == 1,
+                                   max_faces=max_faces)
 
-# Load face detection cascade classifier
-face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+def encode_case_photos(photo_data):
+    """
+    Detect and encode uploaded case photos concurrently, one result per photo.
+    Photos with several faces are not encoded, since they are rejected anyway.
+    """
+    return INGEST_ENCODING_SERVICE.encode_many(photo_data, app.config['INGEST_DETECTION'], max_faces=1)
 
 # === FACE ENCODING CACHE ===
-FACE_ENCODING_CACHE = []  # List of numpy arrays
-FACE_INFO_CACHE = []     # List of (case, photo) tuples
+FACE_GALLERY = FaceGallery()  # Contiguous float32 matrix of known encodings
+SHARED_GALLERY = SharedGallery(FACE_GALLERY)  # Shares gallery updates with the other worker processes
+
+# Approximate matching only pays off on large galleries; below this size scans stay exact
+ANN_MIN_GALLERY_SIZE = 50000
+ANN_PROBES = 16  # Inverted lists searched per scan; higher is slower but closer to exact
+FACE_GALLERY.enable_ann(IVFIndex(n_probe=ANN_PROBES), min_size=ANN_MIN_GALLERY_SIZE)
 
 def load_face_encoding_cache():
-    global FACE_ENCODING_CACHE, FACE_INFO_CACHE
-    FACE_ENCODING_CACHE = []
-    FACE_INFO_CACHE = []
-    cases = Case.query.all()
-    for case in cases:
-        for photo in getattr(case, 'photos', []):
-            if photo.face_encoding:
-                try:
-                    db_encoding = np.array(json.loads(photo.face_encoding))
-                    FACE_ENCODING_CACHE.append(db_encoding)
-                    FACE_INFO_CACHE.append((case, photo))
-                except Exception as e:
-                    app.logger.error(f"Error decoding face encoding for cache: {e}")
+    FACE_GALLERY.clear()
+    # Plain column rows only; no Case/Photo objects are kept alive by the cache
+    rows = db.session.query(Photo.id, Photo.case_id, Photo.face_encoding_blob, Photo.face_encoding, Case.status)\
+        .join(Case, Photo.case_id == Case.id)\
+        .filter(db.or_(Photo.face_encoding_blob.isnot(None), Photo.face_encoding.isnot(None))).all()
+    for photo_id, case_id, face_encoding_blob, face_encoding, status in rows:
+        try:
+            FACE_GALLERY.add(photo_id, case_id, decode_photo_encoding(face_encoding_blob, face_encoding), status)
+        except Exception as e:
+            app.logger.error(f"Error decoding face encoding for cache: {e}")
+
+def add_photos_to_cache(case, photos):
+    """Add or refresh the given photos of a case in the gallery."""
+    for photo in photos:
+        if photo.face_encoding_blob or photo.face_encoding:
+            try:
+                encoding = decode_photo_encoding(photo.face_encoding_blob, photo.face_encoding)
+                FACE_GALLERY.add(photo.id, case.id, encoding, case.status)
+            except Exception as e:
+                app.logger.error(f"Error decoding face encoding for cache: {e}")
+
+def remove_photos_from_cache(photo_ids):
+    FACE_GALLERY.remove_many(photo_ids)
+
+def gallery_fingerprint():
+    """
+    Cheap summary of the photo and case tables, used to spot shared galleries
+    and snapshots made stale outside the app. The latest Case.updated_at
+    catches status changes, which move photos between partitions.
+    """
+    count, max_id = db.session.query(db.func.count(Photo.id), db.func.max(Photo.id)).one()
+    last_update = db.session.query(db.func.max(Case.updated_at)).scalar()
+    updated_us = int((last_update - datetime(1970, 1, 1)).total_seconds() * 1000000) if last_update else 0
+    return [count, max_id or 0, updated_us]
+
+# Seconds a gallery change waits before the snapshot is rewritten; later changes ride along
+SNAPSHOT_DELAY = 30
+SNAPSHOT_PENDING = threading.Event()
+
+def save_face_gallery_snapshot():
+    """
+    Rewrite the on-disk snapshot from the latest shared generation, with the
+    fingerprint it was published under. Holds the writers' lock, so workers
+    never delete each other's generation files.
+    """
+    try:
+        with SHARED_GALLERY.exclusive() as gallery:
+            save_snapshot(gallery, fingerprint=SHARED_GALLERY.fingerprint)
+    except Exception as e:
+        app.logger.error(f"Error saving face gallery snapshot: {e}")
+
+def snapshot_worker():
+    """
+    Background thread: rewrites the snapshot once per burst of gallery
+    changes instead of inside every request that makes one. A snapshot
+    missed at shutdown only costs a rebuild, since its fingerprint is stale.
+    """
+    while True:
+        SNAPSHOT_PENDING.wait()
+        time.sleep(SNAPSHOT_DELAY)
+        SNAPSHOT_PENDING.clear()
+        save_face_gallery_snapshot()
+
+def load_face_gallery():
+    """
+    Attach the gallery another worker already shared if it is current, else
+    memory-map the on-disk snapshot, else rebuild it from the database.
+    Runs under the writers' lock, so workers starting together load it once.
+    """
+    fingerprint = gallery_fingerprint()
+    with SHARED_GALLERY.exclusive():
+        if SHARED_GALLERY.generation and SHARED_GALLERY.fingerprint == fingerprint:
+            app.logger.info(f"Attached shared face gallery with {len(FACE_GALLERY)} encodings")
+            return
+        snapshot = load_snapshot()
+        rebuilt = snapshot is None or snapshot[1].get('fingerprint') != fingerprint
+        if rebuilt:
+            load_face_encoding_cache()
+        else:
+            FACE_GALLERY.attach(snapshot[0], snapshot[1].get('ann_trained_size', 0))
+            app.logger.info(f"Mapped face gallery snapshot with {len(FACE_GALLERY)} encodings")
+        SHARED_GALLERY.publish(fingerprint)
+        if rebuilt:
+            save_face_gallery_snapshot()
+
+@contextmanager
+def face_gallery_update():
+    """
+    Apply a change to the gallery on top of the latest shared generation, then
+    publish it to the other workers. The snapshot follows within SNAPSHOT_DELAY.
+    """
+    with SHARED_GALLERY.writer(fingerprint=gallery_fingerprint) as gallery:
+        yield gallery
+    SNAPSHOT_PENDING.set()
 
 # Load cache at startup
 with app.app_context():
-    load_face_encoding_cache()
+    try:
+        load_face_gallery()
+    except Exception as e:
+        # Schema may be missing or not yet upgraded (e.g. while running `flask db upgrade`)
+        db.session.rollback()
+        app.logger.error(f"Could not load face encoding cache: {e}")
+
+# === BACKGROUND PHOTO INGESTION ===
+INGEST_POLL_INTERVAL = 2  # Seconds between queue checks when not woken by a local upload
+INGEST_MAX_ATTEMPTS = 3
+INGEST_RETRY_DELAY = 30  # Seconds before a failed attempt is retried, doubling with each attempt
+INGEST_BATCH_SIZE = 16  # Queued photos encoded concurrently per pass
+# Seconds before a 'processing' job whose worker died is retried. A live pass may wait up to
+# the encoding timeout for each photo's queue slot and again for its result, so stay above that
+INGEST_STALE_AFTER = 2 * INGEST_BATCH_SIZE * app.config['ENCODING_TIMEOUT'] + 60
+INGEST_STAGING_DIR = 'data/uploads'  # Queued uploads; moved into the photo store once encoded
+INGEST_WAKEUP = threading.Event()
+
+def staged_upload_path(job):
+    return os.path.join(INGEST_STAGING_DIR, job.filename)
+
+def remove_staged_uploads(case):
+    """Delete the staged files of a case's queued uploads, which have no Photo row to clean up after them."""
+    for job in case.ingest_jobs:
+        if job.status != 'done' and os.path.exists(staged_upload_path(job)):
+            os.remove(staged_upload_path(job))
+
+def remove_photo_file(photo):
+    """Delete a photo's file unless another Photo still uses it (identical uploads share one file)."""
+    shared = Photo.query.filter(Photo.filename == photo.filename, Photo.id != photo.id).first()
+    if shared is None:
+        PHOTO_STORE.delete(photo.filename)
+
+def duplicate_photo_warning(upload_name, photo):
+    """Flash that an upload is byte-identical to a photo already stored on another case."""
+    other = db.session.get(Case, photo.case_id)
+    if current_user.role == 'admin' or (other and other.reporter_id == current_user.id):
+        flash(f'Photo {upload_name} is identical to a photo of case #{photo.case_id} ({other.name}). '
+              f'Please check this is not a duplicate case.', 'warning')
+    else:
+        flash(f'Photo {upload_name} is identical to a photo already registered for another case. '
+              f'Please check this is not a duplicate case.', 'warning')
+
+def enqueue_case_photos(case, uploads):
+    """
+    Stage uploaded photos and queue them for detection and encoding. Only
+    photos that encode successfully are moved into the photo store.
+
+    Uploads are keyed by the SHA-256 of their bytes. A photo already stored
+    is attached straight away, reusing its file and encoding, and one whose
+    detection result is memoized as a failure is rejected without running
+    dlib again. Returns the queued jobs.
+    """
+    jobs = []
+    reused = []
+    for upload in uploads:
+        if not upload:
+            continue
+        data = upload.read()
+        key = content_hash(data)
+        name = upload.filename
+
+        existing = Photo.query.filter_by(content_hash=key).order_by(Photo.id).all()
+        if any(photo.case_id == case.id for photo in existing):
+            flash(f'Photo {name} is already attached to this case.', 'info')
+            continue
+        if existing:
+            duplicate_photo_warning(name, existing[0])
+            if existing[0].face_encoding_blob:
+                photo = Photo(filename=existing[0].filename, face_encoding_blob=existing[0].face_encoding_blob,
+                              content_hash=key, case_id=case.id)
+                db.session.add(photo)
+                db.session.flush()
+                db.session.add(IngestJob(case_id=case.id, filename=photo.filename, original_name=name,
+                                         content_hash=key, status='done', photo_id=photo.id))
+                reused.append(photo)
+                continue
+
+        memo = db.session.get(EncodingMemo, key)
+        if memo is not None and memo.face_encoding_blob is None:
+            flash(ingest_failure_message(name, memo), 'error')
+            continue
+
+        filename = f"{case.id}_{uuid.uuid4().hex}.upload"
+        atomic_write(os.path.join(INGEST_STAGING_DIR, filename), data)
+        job = IngestJob(case_id=case.id, filename=filename, original_name=name, content_hash=key)
+        db.session.add(job)
+        jobs.append(job)
+    db.session.commit()
+    if reused:
+        with face_gallery_update():
+            add_photos_to_cache(case, reused)
+    if jobs:
+        INGEST_WAKEUP.set()
+    return jobs
+
+def claim_ingest_jobs(limit=INGEST_BATCH_SIZE):
+    """
+    Take up to `limit` of the oldest pending (or abandoned) jobs, skipping
+    re-queued ones until their retry time. The status/attempts check in each
+    UPDATE makes the claim atomic across threads and worker processes.
+    """
+    now = datetime.utcnow()
+    stale = now - timedelta(seconds=INGEST_STALE_AFTER)
+    candidates = IngestJob.query.filter(db.or_(
+        db.and_(IngestJob.status == 'pending',
+                db.or_(IngestJob.retry_at.is_(None), IngestJob.retry_at <= now)),
+        db.and_(IngestJob.status == 'processing', IngestJob.updated_at < stale)
+    )).order_by(IngestJob.id).limit(limit).all()
+    claimed_ids = []
+    for job in candidates:
+        guard = IngestJob.query.filter_by(id=job.id, status=job.status, attempts=job.attempts)
+        if job.attempts >= INGEST_MAX_ATTEMPTS:
+            # Abandoned on its last attempt: the photo keeps killing or stalling its worker
+            if guard.update({'status': 'failed', 'error': 'Photo could not be processed. Please upload it again.'},
+                            synchronize_session=False) and os.path.exists(staged_upload_path(job)):
+                os.remove(staged_upload_path(job))
+            continue
+        claimed = guard.update(
+            {'status': 'processing', 'attempts': job.attempts + 1, 'updated_at': now, 'retry_at': None},
+            synchronize_session=False)
+        if claimed:
+            claimed_ids.append(job.id)
+    db.session.commit()
+    if not claimed_ids:
+        return []
+    return IngestJob.query.filter(IngestJob.id.in_(claimed_ids)).order_by(IngestJob.id).all()
+
+def fail_ingest_job(job, error):
+    """Mark a job failed and drop its staged upload; committed by the caller."""
+    job.status = 'failed'
+    job.error = error
+    if os.path.exists(staged_upload_path(job)):
+        os.remove(staged_upload_path(job))
+
+def remember_encoding(content_hash, encoded):
+    """Memoize an encode_image result under the image's content hash. Returns the EncodingMemo."""
+    face_locations, face_encodings = encoded
+    blob = None
+    if len(face_locations) == 1 and face_encodings:
+        blob = encoding_to_bytes(face_encodings[0])
+    memo = EncodingMemo(content_hash=content_hash, face_count=len(face_locations), face_encoding_blob=blob)
+    if content_hash:  # Jobs queued before content hashing have none
+        memo = db.session.merge(memo)
+    return memo
+
+def ingest_failure_message(name, memo):
+    """Why a photo with this detection result cannot be used."""
+    if memo.face_count == 0:
+        return f'No face detected in photo {name}. Please upload a clear, front-facing photo.'
+    if memo.face_count > 1:
+        return f'Multiple faces detected in photo {name}. Please upload a photo with only one face.'
+    return f'Face encoding failed for photo {name}. Please try a different photo.'
+
+def ingest_job_photo(job, outcome):
+    """
+    Apply a detection outcome (an EncodingMemo, None for an unreadable image,
+    or the exception that stopped encoding) to its job. Returns the new Photo,
+    or None after marking the job failed or re-queued.
+    """
+    name = job.original_name or job.filename
+    if isinstance(outcome, Exception):
+        # Queue full, timeout or a crashed worker: try again later, backing off each time
+        if job.attempts >= INGEST_MAX_ATTEMPTS:
+            fail_ingest_job(job, 'Photo could not be processed. Please upload it again.')
+        else:
+            job.status = 'pending'
+            job.retry_at = datetime.utcnow() + timedelta(seconds=INGEST_RETRY_DELAY * 2 ** (job.attempts - 1))
+        return None
+    if outcome is None:
+        fail_ingest_job(job, f'Could not read photo {name}. Please upload a JPEG or PNG image.')
+        return None
+    if outcome.face_encoding_blob is None:
+        fail_ingest_job(job, ingest_failure_message(name, outcome))
+        return None
+    return Photo(
+        face_encoding_blob=outcome.face_encoding_blob,
+        content_hash=job.content_hash,
+        case_id=job.case_id
+    )
+
+def process_ingest_jobs(jobs):
+    """
+    Encode a batch of queued photos concurrently in the encoding pool, then
+    store them with one commit and index them with one gallery update.
+    Photos whose content hash is already memoized skip dlib entirely.
+    """
+    hashes = {job.content_hash for job in jobs if job.content_hash}
+    memos = {memo.content_hash: memo
+             for memo in EncodingMemo.query.filter(EncodingMemo.content_hash.in_(hashes))}
+    photo_data = {}
+    for job in jobs:
+        if job.content_hash in memos:
+            continue
+        try:
+            with open(staged_upload_path(job), 'rb') as f:
+                photo_data[job.id] = f.read()
+        except OSError:
+            pass
+    encoded = dict(zip(photo_data, encode_case_photos(list(photo_data.values()))))
+
+    # Cases deleted while their photos were encoding took their jobs with them
+    live_case_ids = {case_id for (case_id,) in db.session.query(Case.id).filter(
+        Case.id.in_({job.case_id for job in jobs}))}
+    new_photos = {}
+    for job in jobs:
+        if job.case_id not in live_case_ids:
+            continue
+        if not os.path.exists(staged_upload_path(job)):
+            fail_ingest_job(job, 'Uploaded file is missing')
+            continue
+        if job.content_hash in memos:
+            outcome = memos[job.content_hash]
+        else:
+            outcome = encoded.get(job.id)
+            if outcome is not None and not isinstance(outcome, Exception):
+                outcome = remember_encoding(job.content_hash, outcome)
+        photo = ingest_job_photo(job, outcome)
+        if photo is None:
+            continue
+        photo.filename = PHOTO_STORE.put_file(staged_upload_path(job), job.content_hash)
+        # Case lists show the thumbnail first; generate it now rather than on that request
+        PHOTO_STORE.thumbnail_path(photo.filename, PHOTO_VARIANTS['thumb'])
+        db.session.add(photo)
+        db.session.flush()
+        job.status = 'done'
+        job.error = None
+        job.photo_id = photo.id
+        new_photos.setdefault(job.case_id, []).append(photo)
+    db.session.commit()
+
+    if new_photos:
+        with face_gallery_update():
+            for case_id, photos in new_photos.items():
+                case = db.session.get(Case, case_id)
+                if case is not None:
+                    add_photos_to_cache(case, photos)
+
+def ingest_worker():
+    """Background thread: drains the ingestion queue, then waits for new uploads."""
+    while True:
+        INGEST_WAKEUP.wait(INGEST_POLL_INTERVAL)
+        INGEST_WAKEUP.clear()
+        with app.app_context():
+            try:
+                jobs = claim_ingest_jobs()
+                while jobs:
+                    process_ingest_jobs(jobs)
+                    jobs = claim_ingest_jobs()
+            except Exception as e:
+                db.session.rollback()
+                app.logger.error(f"Error in photo ingestion: {str(e)}")
+            finally:
+                db.session.remove()
+
+BACKGROUND_LOCK = threading.Lock()
+BACKGROUND_STARTED = False
+
+def start_background_services(fork=True):
+    """
+    Start and warm the encoding workers and start the ingest consumer. Called
+    once by the process that serves requests, never at import: flask db
+    upgrade and the admin scripts import this module too, and a consumer
+    killed when such a script exits would leave its claimed jobs stuck in
+    'processing' for INGEST_STALE_AFTER.
+
+    Supported entry points:
+    - `python app.py` calls this before the server starts its request
+      threads, so the workers are forked straight from the app.
+    - Any other server (a WSGI server, `flask run`) gets it on the first
+      request, from a request thread, with `fork=False`: the workers are
+      then started from a fork server, never forked from a threaded process.
+    """
+    global BACKGROUND_STARTED
+    with BACKGROUND_LOCK:
+        if BACKGROUND_STARTED:
+            return
+        BACKGROUND_STARTED = True
+        ENCODING_SERVICE.start(fork)
+        INGEST_ENCODING_SERVICE.start(fork)
+        threading.Thread(target=ingest_worker, name='photo-ingest', daemon=True).start()
+        threading.Thread(target=snapshot_worker, name='gallery-snapshot', daemon=True).start()
+
+@app.before_request
+def ensure_background_services():
+    if not BACKGROUND_STARTED:
+        start_background_services(fork=False)
 
 # Initialize face recognition model
 def load_face_encodings():
@@ -183,6 +617,12 @@ else:
 def load_user(user_id):
     return User.query.get(int(user_id))
 
+@app.errorhandler(413)
+def request_too_large(e):
+    if request.path.startswith('/api/'):
+        return jsonify({"success": False, "message": "Upload is too large."}), 413
+    return e
+
 # Create database tables
 with app.app_context():
     db.create_all()
@@ -395,41 +835,12 @@ def new_case():
         db.session.add(case)
         db.session.commit()
         
-        # Handle photo uploads
-        photos = request.files.getlist('photos')
-        for photo in photos:
-            if photo:
-                filename = f"{case.id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jpg"
-                photo_path = os.path.join('data/faces', filename)
-                photo.save(photo_path)
-
-                # Detect faces using OpenCV
-                image = cv2.imread(photo_path)
-                rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-                face_locations = face_recognition.face_locations(rgb_image)
-                if len(face_locations) == 0:
-                    flash(f'No face detected in photo {photo.filename}. Please upload a clear, front-facing photo.', 'error')
-                    continue
-                if len(face_locations) > 1:
-                    flash(f'Multiple faces detected in photo {photo.filename}. Please upload a photo with only one face.', 'error')
-                    continue
-                face_encodings = face_recognition.face_encodings(rgb_image, face_locations)
-                if not face_encodings:
-                    flash(f'Face encoding failed for photo {photo.filename}. Please try a different photo.', 'error')
-                    continue
-                # Store the first face encoding found
-                encoding_list = face_encodings[0].tolist()
-                photo_record = Photo(
-                    filename=filename,
-                    face_encoding=json.dumps(encoding_list),
-                    case_id=case.id
-                )
-                db.session.add(photo_record)
-        
-        db.session.commit()
+        # Photos are detected, encoded and indexed in the background
+        jobs = enqueue_case_photos(case, request.files.getlist('photos'))
         log_activity('new_case', f'New case registered: {name}')
-        # Update face encoding cache after new case/photo
-        load_face_encoding_cache()
+        if jobs:
+            flash(f'Case registered successfully. {len(jobs)} photo(s) are being processed.', 'success')
+            return redirect(url_for('case_details', case_id=case.id))
         flash('Case registered successfully', 'success')
         return redirect(url_for('view_cases'))
     
@@ -448,116 +859,267 @@ def view_cases():
 @login_required
 def case_details(case_id):
     case = Case.query.get_or_404(case_id)
-    if current_user.role != 'admin' and case.reporter_id != current_user.id:
+    if not can_view_case(case):
         flash('Access denied', 'error')
         return redirect(url_for('view_cases'))
     return render_template('case_details.html', case=case)
 
+@app.route('/api/case/<int:case_id>/ingest')
+@login_required
+def case_ingest_status(case_id):
+    """Per-photo progress of the case's background photo processing."""
+    case = Case.query.get_or_404(case_id)
+    if not can_view_case(case):
+        return jsonify({"success": False, "message": "Access denied"}), 403
+    jobs = IngestJob.query.filter_by(case_id=case.id).order_by(IngestJob.id).all()
+    return jsonify({
+        "success": True,
+        "pending": sum(1 for job in jobs if job.status in ('pending', 'processing')),
+        "jobs": [{
+            'id': job.id,
+            'name': job.original_name or job.filename,
+            'status': job.status,
+            'error': job.error,
+            'photo_id': job.photo_id
+        } for job in jobs]
+    })
+
+# Matching thresholds for scans
+MATCH_TOLERANCE = 0.4  # Maximum face distance accepted as a match
+DEFAULT_TOP_K = 5      # Ranked candidate cases returned per scan
+MAX_TOP_K = 20
+# Images accepted by one /api/scan/batch request
+MAX_BATCH_IMAGES = 100
+MAX_ARCHIVE_IMAGE_BYTES = 16 * 1024 * 1024  # Uncompressed size limit per archive entry
+MAX_BATCH_BYTES = 256 * 1024 * 1024  # Uncompressed size limit for a whole batch
+
+def load_ranked_cases(ranked):
+    """Fetch the Case rows for a ranked result list in one query, keyed by id."""
+    case_ids = [case_id for case_id, _, _ in ranked]
+    if not case_ids:
+        return {}
+    return {case.id: case for case in Case.query.filter(Case.id.in_(case_ids)).all()}
+
+def can_view_case(case):
+    """Admins see every case; other users only the cases they reported."""
+    return current_user.role == 'admin' or case.reporter_id == current_user.id
+
+def candidate_to_dict(case, distance):
+    return {
+        'case_id': case.id,
+        'name': case.name,
+        'status': case.status,
+        'distance': round(distance, 4),
+        'match_accuracy': round(1.0 - distance, 3),
+        'is_match': distance <= MATCH_TOLERANCE
+    }
+
+def notify_guardian_of_match(case, location):
+    """Send the match SMS to the case guardian. Returns (sent, error, message_id)."""
+    if case.status == 'found':
+        return False, 'Case is already marked as found', None
+    try:
+        return send_match_notification(
+            case.guardian_phone,
+            case.name,
+            location,
+            {
+                'guardian_name': case.guardian_name,
+                'age': case.age,
+                'gender': case.gender
+            }
+        )
+    except Exception as e:
+        return False, str(e), None
+
+def match_to_dict(case, distance, notification):
+    notification_sent, notification_error, message_id = notification
+    return {
+        'case_id': case.id,
+        'name': case.name,
+        'age': case.age,
+        'gender': case.gender,
+        'last_seen_location': case.last_seen_location,
+        'last_seen_date': case.last_seen_date.strftime('%Y-%m-%d') if case.last_seen_date else None,
+        'guardian_name': case.guardian_name,
+        'guardian_phone': case.guardian_phone,
+        'match_accuracy': round(1.0 - distance, 3),
+        'match_warning': None,
+        'notification_sent': notification_sent,
+        'notification_error': notification_error,
+        'message_id': message_id
+    }
+
+SCAN_IMAGE_TYPES = ('image/jpeg', 'image/png')
+
+def scan_image_data():
+    """
+    Bytes of the scanned image: a raw image/jpeg (or image/png) request body,
+    a multipart `face_image` file, or the legacy base64 data URL form field.
+    Returns None if the request carries no image.
+    """
+    if request.mimetype in SCAN_IMAGE_TYPES:
+        return request.get_data(cache=False)
+    upload = request.files.get('face_image')
+    if upload:
+        return upload.read()
+    data_url = request.form.get('face_image')
+    if data_url:
+        return base64.b64decode(data_url.split(',', 1)[-1])
+    return None
+
+def scan_location():
+    """Where the scan was taken, sent as form fields or, with a raw image body, in the query string."""
+    return {
+        'latitude': request.values.get('latitude', '0'),
+        'longitude': request.values.get('longitude', '0'),
+        'address': request.values.get('address', 'Unknown location'),
+        'timestamp': datetime.now().isoformat()
+    }
+
+def scan_options():
+    """(top_k, include_archived) for a scan request."""
+    top_k = min(max(request.values.get('top_k', DEFAULT_TOP_K, type=int), 1), MAX_TOP_K)
+    # Found cases live in the archived partition; only admins may opt into searching it
+    include_archived = current_user.role == 'admin' and \
+        request.values.get('include_archived', '').lower() in ('1', 'true', 'on')
+    return top_k, include_archived
+
+def match_faces(face_encodings, location, top_k=DEFAULT_TOP_K, include_archived=False):
+    """
+    Match several probe encodings against the gallery in one batched pass.
+    Returns a (matches, candidates) pair per encoding. The guardian of each
+    matched case is notified at most once per call.
+
+    `location` is where the probes were taken, or a list with one location
+    per encoding; a face whose location is None is matched without notifying.
+    """
+    locations = location if isinstance(location, list) else [location] * len(face_encodings)
+    # Searches the latest generation, including other workers' updates
+    ranked_lists = SHARED_GALLERY.scan(
+        lambda: match_many(face_encodings, FACE_GALLERY, top_k, include_archived=include_archived))
+    cases = load_ranked_cases([result for ranked in ranked_lists for result in ranked])
+    notifications = {}
+    results = []
+    for ranked, face_location in zip(ranked_lists, locations):
+        # A match is shown to whoever scanned it; near misses only to those who may open the case
+        candidates = [candidate_to_dict(cases[case_id], distance)
+                      for case_id, _, distance in ranked
+                      if case_id in cases and (distance <= MATCH_TOLERANCE or can_view_case(cases[case_id]))]
+        matches = []
+        if ranked and ranked[0][2] <= MATCH_TOLERANCE and ranked[0][0] in cases:
+            case_id, _, distance = ranked[0]
+            case = cases[case_id]
+            if face_location is None:
+                notification = (False, 'No capture location for this image', None)
+            else:
+                if case_id not in notifications:
+                    notifications[case_id] = notify_guardian_of_match(case, face_location)
+                notification = notifications[case_id]
+            matches.append(match_to_dict(case, distance, notification))
+        results.append((matches, candidates))
+    return results
+
+# The routes/api.py blueprint matches through the same pipeline as /api/scan
+app.extensions['face_matching'] = {
+    'encode': encode_scan_image,
+    'match': match_faces,
+    'notify': notify_guardian_of_match,
+}
+app.register_blueprint(api_blueprint)
+
+@app.route('/face-scan')
+@login_required
+def face_scan():
+    return render_template('face_scan.html', capture_max_dimension=app.config['SCAN_DETECTION']['max_dimension'])
+
 @app.route('/scan')
 @login_required
 def scan():
-    return render_template('scan.html')
+    return render_template('scan.html', capture_max_dimension=app.config['SCAN_DETECTION']['max_dimension'])
+
+@app.route('/api/scan/config')
+@login_required
+def api_scan_config():
+    """
+    Capture settings for scan clients. Frames larger than max_dimension are
+    only shrunk again on the server, so clients should downscale before upload.
+    """
+    return jsonify({
+        "success": True,
+        "max_dimension": app.config['SCAN_DETECTION']['max_dimension'],
+        "image_types": list(SCAN_IMAGE_TYPES),
+        "max_batch_images": MAX_BATCH_IMAGES
+    })
 
 @app.route('/api/scan', methods=['POST'])
 @login_required
 def api_scan():
     t0 = time.time()
     try:
-        # Get the base64 image from the request
-        face_image_base64 = request.form['face_image'].split(',')[1]
-        face_image_data = base64.b64decode(face_image_base64)
-        
-        # Convert image data to numpy array
-        nparr = np.frombuffer(face_image_data, np.uint8)
-        image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        
-        if image is None:
+        face_image_data = scan_image_data()
+        if not face_image_data:
+            return jsonify({"success": False, "message": "No image received. Please try again."}), 400
+        # Crowd mode matches every face in the frame instead of rejecting group shots
+        crowd = request.values.get('mode') == 'crowd'
+
+        # Decode, detect and encode in the encoding pool
+        try:
+            encoded = encode_scan_image(face_image_data, max_faces=None if crowd else 1)
+        except (EncodingServiceBusy, EncodingTimeout):
+            return jsonify({"success": False, "message": "Scanner is busy. Please try again in a moment."}), 503
+        if encoded is None:
             return jsonify({"success": False, "message": "Failed to load image. Please try again."}), 400
-        
-        # Get face encoding for the scanned image (resize and crop to face)
-        rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        face_locations = face_recognition.face_locations(rgb_image)
+        face_locations, face_encodings = encoded
         if len(face_locations) == 0:
             return jsonify({
                 "success": True,
                 "message": "No face detected in the image. Please try again with a clear, front-facing photo.",
                 "matches": []
             })
-        if len(face_locations) > 1:
+        if len(face_locations) > 1 and not crowd:
             return jsonify({
                 "success": True,
                 "message": "Multiple faces detected in the image. Please scan only one face at a time.",
                 "matches": []
             })
-        face_encodings = face_recognition.face_encodings(rgb_image, face_locations)
         if not face_encodings:
             return jsonify({
                 "success": True,
                 "message": "Face encoding failed. Please try again with a clearer image.",
                 "matches": []
             })
-        scanned_encoding = face_encodings[0]
-
-        # Use in-memory cache for matching
-        if not FACE_ENCODING_CACHE:
+        top_k, include_archived = scan_options()
+        results = match_faces(face_encodings, scan_location(), top_k, include_archived)
+
+        if crowd:
+            faces = []
+            for (top, right, bottom, left), (matches, candidates) in zip(face_locations, results):
+                faces.append({
+                    'box': [left, top, right, bottom],
+                    'matches': matches,
+                    'candidates': candidates
+                })
             return jsonify({
                 "success": True,
-                "message": "Not found person in our database.",
-                "matches": []
+                "mode": "crowd",
+                "faces": faces,
+                "matches": [match for face in faces for match in face['matches']]
             })
-        # Batch distance calculation
-        distances = face_recognition.face_distance(np.array(FACE_ENCODING_CACHE), scanned_encoding)
-        best_idx = np.argmin(distances)
-        best_distance = distances[best_idx]
-        if best_distance <= 0.4:
-            case, photo = FACE_INFO_CACHE[best_idx]
-            notification_sent = None
-            notification_error = None
-            message_id = None
-            try:
-                from utils.sms_service import send_match_notification
-                notification_sent, notification_error, message_id = send_match_notification(
-                    case.guardian_phone,
-                    case.name,
-                    {
-                        'latitude': request.form.get('latitude', '0'),
-                        'longitude': request.form.get('longitude', '0'),
-                        'address': request.form.get('address', 'Unknown location'),
-                        'timestamp': datetime.now().isoformat()
-                    },
-                    {
-                        'guardian_name': case.guardian_name,
-                        'age': case.age,
-                        'gender': case.gender
-                    }
-                )
-            except Exception as e:
-                notification_sent = False
-                notification_error = str(e)
-                message_id = None
+
+        matches, candidates = results[0]
+        if matches:
             return jsonify({
                 "success": True,
-                "matches": [{
-                    'case_id': case.id,
-                    'name': case.name,
-                    'age': case.age,
-                    'gender': case.gender,
-                    'last_seen_location': case.last_seen_location,
-                    'last_seen_date': case.last_seen_date.strftime('%Y-%m-%d') if case.last_seen_date else None,
-                    'guardian_name': case.guardian_name,
-                    'guardian_phone': case.guardian_phone,
-                    'match_accuracy': round(1.0 - best_distance, 3),
-                    'match_warning': None,
-                    'notification_sent': notification_sent,
-                    'notification_error': notification_error,
-                    'message_id': message_id
-                }]
+                "matches": matches,
+                "candidates": candidates
             })
         else:
             return jsonify({
                 "success": True,
                 "message": "Not found person in our database.",
-                "matches": []
+                "matches": [],
+                "candidates": candidates
             })
     except Exception as e:
         app.logger.error(f"Error in face scanning: {str(e)}")
@@ -566,6 +1128,187 @@ def api_scan():
         t1 = time.time()
         app.logger.info(f"Scan processing time: {t1-t0:.3f} seconds")
 
+def batch_scan_images():
+    """
+    (filename, bytes) for each image in a batch upload: multipart `images`
+    files and/or the entries of a zip `archive`. Raises BatchTooLarge as soon
+    as the batch passes MAX_BATCH_IMAGES or MAX_BATCH_BYTES, before anything
+    more is decompressed, and UnsafeArchive for nested archives or entry
+    names that could leave a directory.
+    """
+    uploads = [f for f in request.files.getlist('images') if f.filename]
+    if len(uploads) > MAX_BATCH_IMAGES:
+        raise BatchTooLarge(f"At most {MAX_BATCH_IMAGES} images per batch.")
+    images = [(f.filename, f.read()) for f in uploads]
+    archive = request.files.get('archive')
+    if archive and archive.filename:
+        read_archive_images(archive.read(), images, MAX_BATCH_IMAGES, MAX_ARCHIVE_IMAGE_BYTES, MAX_BATCH_BYTES)
+    return images
+
+def batch_scan_locations():
+    """
+    Where and when each image of a batch was captured, from an optional JSON
+    `manifest` (form field or file) keyed by filename:
+    {"IMG_0001.jpg": {"latitude": .., "longitude": .., "timestamp": .., "address": ..}}.
+    Images queued offline must not be reported where and when the device
+    reconnected, so images without latitude, longitude and timestamp are
+    absent from the result.
+    """
+    manifest = request.files.get('manifest')
+    raw = manifest.read() if manifest else request.form.get('manifest')
+    if not raw:
+        return {}
+    entries = json.loads(raw)
+    if not isinstance(entries, dict):
+        raise ValueError('manifest must be an object keyed by filename')
+    locations = {}
+    for filename, entry in entries.items():
+        if not isinstance(entry, dict) or not all(entry.get(key) for key in ('latitude', 'longitude', 'timestamp')):
+            continue
+        locations[filename] = {
+            'latitude': str(entry['latitude']),
+            'longitude': str(entry['longitude']),
+            'address': entry.get('address') or 'Unknown location',
+            'timestamp': str(entry['timestamp'])
+        }
+    return locations
+
+@app.route('/api/scan/batch', methods=['POST'])
+@login_required
+def api_scan_batch():
+    """
+    Scan many queued images in one request. Every face found in every image
+    is matched in a single batched gallery pass; results come back per image,
+    in upload order. Guardians are only notified for images with a capture
+    location in the manifest (see batch_scan_locations).
+    """
+    t0 = time.time()
+    try:
+        try:
+            images = batch_scan_images()
+        except zipfile.BadZipFile:
+            return jsonify({"success": False, "message": "Archive is not a valid zip file."}), 400
+        except (BatchTooLarge, UnsafeArchive) as e:
+            return jsonify({"success": False, "message": str(e)}), 400
+        try:
+            capture_locations = batch_scan_locations()
+        except ValueError:
+            return jsonify({"success": False, "message": "Manifest must be a JSON object keyed by filename."}), 400
+        if not images:
+            return jsonify({"success": False, "message": "No images uploaded."}), 400
+
+        results = []
+        face_encodings = []
+        face_owners = []
+        face_capture_locations = []
+        # All images of the batch are encoded concurrently in the encoding pool
+        # No Haar prefilter: queue and camp photos are full of small or turned faces
+        encoded_images = ENCODING_SERVICE.encode_many(
+            [data for _, data in images], app.config['SCAN_DETECTION'])
+        for (filename, _), encoded in zip(images, encoded_images):
+            result = {'filename': filename, 'faces': [], 'matches': []}
+            results.append(result)
+            if isinstance(encoded, Exception):
+                result['message'] = "Could not encode this image. Please retry it."
+                continue
+            if encoded is None:
+                result['message'] = "Failed to load image."
+                continue
+            face_locations, encodings = encoded
+            if not face_locations:
+                result['message'] = "No face detected in the image."
+                continue
+            for (top, right, bottom, left), encoding in zip(face_locations, encodings):
+                face = {'box': [left, top, right, bottom]}
+                result['faces'].append(face)
+                face_encodings.append(encoding)
+                face_owners.append((result, face))
+                face_capture_locations.append(capture_locations.get(filename))
+
+        if face_encodings:
+            top_k, include_archived = scan_options()
+            matched = match_faces(face_encodings, face_capture_locations, top_k, include_archived)
+            for (result, face), (matches, candidates) in zip(face_owners, matched):
+                face['matches'] = matches
+                face['candidates'] = candidates
+                result['matches'].extend(matches)
+
+        return jsonify({"success": True, "results": results})
+    except Exception as e:
+        app.logger.error(f"Error in batch face scanning: {str(e)}")
+        return jsonify({"success": False, "message": "Error processing batch scan. Please try again."}), 500
+    finally:
+        app.logger.info(f"Batch scan processing time: {time.time() - t0:.3f} seconds")
+
+# Faces followed across the frames of each live recognition session
+FACE_TRACKER = FaceTracker()
+
+def recognition_session_key():
+    """Key of the caller's live recognition session, kept in the login session cookie."""
+    if 'recognition_id' not in session:
+        session['recognition_id'] = uuid.uuid4().hex
+    return f"{current_user.id}:{session['recognition_id']}"
+
+def identify_encodings(face_encodings):
+    """(case_id, distance) of the closest open case for each encoding; case_id is None past MATCH_TOLERANCE."""
+    identities = []
+    for ranked in SHARED_GALLERY.scan(lambda: match_many(face_encodings, FACE_GALLERY, 1)):
+        if not ranked:
+            identities.append((None, float('inf')))
+            continue
+        case_id, _, distance = ranked[0]
+        identities.append((case_id if distance <= MATCH_TOLERANCE else None, distance))
+    return identities
+
+@app.route('/recognition')
+@login_required
+def recognition():
+    return render_template('recognition.html', capture_max_dimension=app.config['SCAN_DETECTION']['max_dimension'])
+
+@app.route('/api/recognize', methods=['POST'])
+@login_required
+def api_recognize():
+    """
+    Continuous recognition for a live camera feed. Faces are still detected
+    in every frame, but one that stayed in place since the previous frame
+    and was confidently identified keeps that identity without being encoded
+    again. Guardians are not notified from here; that is /api/scan's job.
+    """
+    try:
+        face_image_data = scan_image_data()
+        if not face_image_data:
+            return jsonify({"success": False, "message": "No image received. Please try again."}), 400
+        key = recognition_session_key()
+        reusable = FACE_TRACKER.reusable(key)
+        try:
+            encoded = ENCODING_SERVICE.encode(face_image_data, app.config['SCAN_DETECTION'],
+                                              prefilter=app.config['SCAN_HAAR_PREFILTER'],
+                                              reuse=[track.box for track in reusable])
+        except (EncodingServiceBusy, EncodingTimeout):
+            return jsonify({"success": False, "message": "Scanner is busy. Please try again in a moment."}), 503
+        if encoded is None:
+            return jsonify({"success": False, "message": "Failed to load image. Please try again."}), 400
+        face_locations, face_encodings = encoded
+
+        tracks = FACE_TRACKER.update(key, face_locations, face_encodings, reusable, identify_encodings)
+        cases = load_ranked_cases([(track.case_id, None, track.distance) for track in tracks
+                                   if track.case_id is not None])
+        results = []
+        for track in tracks:
+            top, right, bottom, left = track.box
+            case = cases.get(track.case_id)
+            results.append({
+                'name': case.name if case else 'Unknown',
+                'case_id': case.id if case else None,
+                'box': [left, top, right, bottom],
+                'match_accuracy': round(1.0 - track.distance, 3) if case else None,
+                'tracked': track.reused > 0
+            })
+        return jsonify({"success": True, "results": results})
+    except Exception as e:
+        app.logger.error(f"Error in face recognition: {str(e)}")
+        return jsonify({"success": False, "message": "Error processing frame. Please try again."}), 500
+
 @app.route('/profile', methods=['GET', 'POST'])
 @login_required
 def profile():
@@ -615,6 +1358,9 @@ def update_case_status(case_id):
     
     case.status = new_status
     db.session.commit()
+    # Only the case's rows change partition, so they are rewritten in the shared segment in place
+    SHARED_GALLERY.set_case_status(case.id, new_status, fingerprint=gallery_fingerprint)
+    SNAPSHOT_PENDING.set()
     
     log_activity('status_update', f'Case {case.name} status updated to {new_status}')
     return jsonify({"success": True})
@@ -625,24 +1371,25 @@ def update_case_status(case_id):
 def delete_case(case_id):
     try:
         case = Case.query.get_or_404(case_id)
+        photo_ids = [photo.id for photo in case.photos]
         
         # Delete associated photos from database first
         for photo in case.photos:
             try:
                 # Try to delete the physical file
-                photo_path = os.path.join('data/faces', photo.filename)
-                if os.path.exists(photo_path):
-                    os.remove(photo_path)
+                remove_photo_file(photo)
             except Exception as e:
                 app.logger.error(f"Error deleting photo file {photo.filename}: {str(e)}")
             # Delete the photo record from database
             db.session.delete(photo)
+        remove_staged_uploads(case)
         
         # Delete the case
         db.session.delete(case)
         db.session.commit()
         
-        load_face_encoding_cache()
+        with face_gallery_update():
+            remove_photos_from_cache(photo_ids)
         log_activity('case_deleted', f'Case {case.name} deleted')
         return jsonify({"success": True})
     except Exception as e:
@@ -681,15 +1428,19 @@ def delete_user(user_id):
     user = User.query.get_or_404(user_id)
     
     # Delete associated cases and photos
+    photo_ids = []
     for case in user.cases:
         for photo in case.photos:
-            photo_path = os.path.join('data/faces', photo.filename)
-            if os.path.exists(photo_path):
-                os.remove(photo_path)
+            photo_ids.append(photo.id)
+            remove_photo_file(photo)
+            db.session.delete(photo)
+        remove_staged_uploads(case)
         db.session.delete(case)
     
     db.session.delete(user)
     db.session.commit()
+    with face_gallery_update():
+        remove_photos_from_cache(photo_ids)
     
     log_activity('user_deleted', f'User {user.username} deleted')
     return jsonify({"success": True})
@@ -984,10 +1735,33 @@ def export_to_pdf():
     output.seek(0)
     return output
 
-@app.route('/face/<filename>')
+@app.route('/face/<path:filename>')
 @login_required
 def serve_face(filename):
-    return send_from_directory('data/faces', filename)
+    """
+    Serve a stored photo, or with ?size=thumb|medium a cached smaller variant.
+    Responses carry a strong ETag and a year-long max-age, so repeat views
+    are answered from the browser cache or with a 304.
+    """
+    size = request.args.get('size')
+    if (size is not None and size not in PHOTO_VARIANTS) or safe_join(PHOTO_STORE.root, filename) is None:
+        abort(404)
+    if not PHOTO_STORE.exists(filename):
+        abort(404)
+    etag = PHOTO_STORE.key_of(filename)
+    path = PHOTO_STORE.path(filename)
+    if size is not None:
+        path = PHOTO_STORE.thumbnail_path(filename, PHOTO_VARIANTS[size])
+        if path is None:
+            abort(404)
+        etag = f'{etag}-{size}'
+    response = send_file(path, etag=etag, last_modified=os.path.getmtime(path),
+                         max_age=PHOTO_MAX_AGE, conditional=True)
+    # Photos are behind login: browsers may cache them, shared proxies may not
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.immutable = True
+    return response
 
 @app.route('/export/<format>')
 @login_required
@@ -1033,52 +1807,52 @@ def edit_case(case_id):
         db.session.commit()
         # Handle photo removals
         remove_photo_ids = request.form.getlist('remove_photos')
+        removed_ids = []
         for photo_id in remove_photo_ids:
             photo = next((p for p in case.photos if str(p.id) == photo_id), None)
             if photo:
-                photo_path = os.path.join('data/faces', photo.filename)
-                if os.path.exists(photo_path):
-                    os.remove(photo_path)
+                remove_photo_file(photo)
+                removed_ids.append(photo.id)
                 db.session.delete(photo)
-        # Handle new photo uploads
-        photos = request.files.getlist('photos')
-        for photo in photos:
-            if photo:
-                filename = f"{case.id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jpg"
-                photo_path = os.path.join('data/faces', filename)
-                photo.save(photo_path)
-
-                # Detect faces using OpenCV
-                image = cv2.imread(photo_path)
-                rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-                face_locations = face_recognition.face_locations(rgb_image)
-                if len(face_locations) == 0:
-                    flash(f'No face detected in photo {photo.filename}. Please upload a clear, front-facing photo.', 'error')
-                    continue
-                if len(face_locations) > 1:
-                    flash(f'Multiple faces detected in photo {photo.filename}. Please upload a photo with only one face.', 'error')
-                    continue
-                face_encodings = face_recognition.face_encodings(rgb_image, face_locations)
-                if not face_encodings:
-                    flash(f'Face encoding failed for photo {photo.filename}. Please try a different photo.', 'error')
-                    continue
-                # Store the first face encoding found
-                encoding_list = face_encodings[0].tolist()
-                photo_record = Photo(
-                    filename=filename,
-                    face_encoding=json.dumps(encoding_list),
-                    case_id=case.id
-                )
-                db.session.add(photo_record)
         db.session.commit()
+        # Refresh only this case in the gallery; new uploads are indexed by the ingest worker
+        with face_gallery_update():
+            remove_photos_from_cache(removed_ids)
+            add_photos_to_cache(case, [p for p in case.photos if p.id not in removed_ids])
+        jobs = enqueue_case_photos(case, request.files.getlist('photos'))
         log_activity('edit_case', f'Case updated: {case.name}')
-        flash('Case updated successfully', 'success')
+        if jobs:
+            flash(f'Case updated successfully. {len(jobs)} photo(s) are being processed.', 'success')
+        else:
+            flash('Case updated successfully', 'success')
         return redirect(url_for('case_details', case_id=case.id))
     return render_template('edit_case.html', form=form, case=case)
 
 # Initialize migration object
 migrate = Migrate(app, db)
 
+@app.cli.command('check-ann-recall')
+@click.option('--probes', default=ANN_PROBES, help='Inverted lists searched per query.')
+@click.option('--queries', default=200, help='Number of stored encodings to sample as queries.')
+def check_ann_recall(probes, queries):
+    """Compare approximate and exact top-5 scan results on the current gallery; fails below ANN_MIN_RECALL."""
+    arrays = FACE_GALLERY.export_arrays()
+    if not len(arrays['encodings']):
+        print("Face gallery is empty.")
+        return
+    gallery = FaceGallery()
+    gallery.attach(arrays)
+    gallery.enable_ann(IVFIndex(n_probe=probes), min_size=0)
+    gallery.prepare_ann()
+    rng = np.random.default_rng(0)
+    sample = arrays['encodings'][rng.choice(len(arrays['encodings']), min(queries, len(arrays['encodings'])), replace=False)]
+    # Perturb the stored encodings so queries resemble fresh photos of known people
+    sample = sample + rng.normal(0, 0.02, sample.shape).astype(np.float32)
+    recall = recall_against_exact(gallery, sample, k=5)
+    print(f"Recall@5 with {probes} probes: {recall:.3f} (minimum {ANN_MIN_RECALL:.2f})")
+    if recall < ANN_MIN_RECALL:
+        raise click.ClickException(f"Recall is below {ANN_MIN_RECALL:.2f}; raise --probes before enabling the index.")
+
 @app.route('/fix-user-dates')
 @login_required
 def fix_user_dates():
@@ -1110,8 +1884,11 @@ def webcam_face_scan():
         return
     with open(encodings_path, 'r') as f:
         encodings_data = json.load(f)
-    known_face_encodings = [np.array(encoding) for encoding in encodings_data.get('encodings', [])]
+    known_face_encodings = np.array(encodings_data.get('encodings', []), dtype=np.float32)
     known_face_ids = encodings_data.get('ids', [])
+    if not len(known_face_encodings):
+        print("No known encodings.")
+        return
 
     # Open webcam
     cap = cv2.VideoCapture(0)
@@ -1131,18 +1908,16 @@ def webcam_face_scan():
             if not ret:
                 print("Failed to capture frame.")
                 break
-            rgb_frame = frame[:, :, ::-1]
+            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
             face_locations = face_recognition.face_locations(rgb_frame)
             face_encodings = face_recognition.face_encodings(rgb_frame, face_locations)
-            for (top, right, bottom, left), face_encoding in zip(face_locations, face_encodings):
-                for encoding in known_face_encodings:
-                    is_match, accuracy = compare_faces(face_encoding, encoding, tolerance=0.4)
-                    if is_match:
-                        # Found a match
-                        break
+            # Every face in the frame against every known encoding in one pass
+            ranked = match_many(np.array(face_encodings), known_face_encodings, k=1, labels=known_face_ids) \
+                if face_encodings else []
+            for (top, right, bottom, left), best in zip(face_locations, ranked):
                 name = "Unknown"
-                if is_match:
-                    name = known_face_ids[known_face_encodings.index(encoding)]
+                if best and best[0][2] <= 0.4:
+                    name = best[0][0]
                 match_results.append(name)
                 # Draw box and label
                 cv2.rectangle(frame, (left, top), (right, bottom), (0, 255, 0), 2)
@@ -1160,4 +1935,8 @@ def webcam_face_scan():
         print("Scan finished and resources cleaned up.")
 
 if __name__ == '__main__':
+    # The debug reloader re-runs this file in the child process that does the serving;
+    # fork the workers there, before the server starts its request threads
+    if is_running_from_reloader():
+        start_background_services()
     app.run(debug=True) 
\ No newline at end of file
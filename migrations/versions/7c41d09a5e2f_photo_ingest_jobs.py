@@ -0,0 +1,46 @@
+"""Queue table for background photo ingestion
+
+Revision ID: 7c41d09a5e2f
+Revises: e2256847b8be
+Create Date: 2026-10-17 11:04:27.306118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c41d09a5e2f'
+down_revision = 'e2256847b8be'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # app.py's import-time db.create_all() may already have built the table from the model
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table('ingest_job'):
+        op.create_table('ingest_job',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('case_id', sa.Integer(), nullable=False),
+        sa.Column('filename', sa.String(length=200), nullable=False),
+        sa.Column('original_name', sa.String(length=200), nullable=True),
+        sa.Column('status', sa.String(length=20), nullable=True),
+        sa.Column('error', sa.String(length=200), nullable=True),
+        sa.Column('attempts', sa.Integer(), nullable=True),
+        sa.Column('photo_id', sa.Integer(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['case_id'], ['case.id'], ),
+        sa.PrimaryKeyConstraint('id')
+        )
+    if 'ix_ingest_job_status' not in {index['name'] for index in inspector.get_indexes('ingest_job')}:
+        with op.batch_alter_table('ingest_job', schema=None) as batch_op:
+            batch_op.create_index(batch_op.f('ix_ingest_job_status'), ['status'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('ingest_job', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_ingest_job_status'))
+
+    op.drop_table('ingest_job')
@@ -0,0 +1,49 @@
+"""Content hashes for photos and the encoding memo table
+
+Revision ID: b93f6e1c8d24
+Revises: 7c41d09a5e2f
+Create Date: 2026-10-17 13:22:08.940517
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b93f6e1c8d24'
+down_revision = '7c41d09a5e2f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # app.py's import-time db.create_all() may already have built the new table, and
+    # ingest_job with its content_hash column, from the models
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table('encoding_memo'):
+        op.create_table('encoding_memo',
+        sa.Column('content_hash', sa.String(length=64), nullable=False),
+        sa.Column('face_count', sa.Integer(), nullable=False),
+        sa.Column('face_encoding_blob', sa.LargeBinary(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('content_hash')
+        )
+    if 'content_hash' not in {column['name'] for column in inspector.get_columns('photo')}:
+        with op.batch_alter_table('photo', schema=None) as batch_op:
+            batch_op.add_column(sa.Column('content_hash', sa.String(length=64), nullable=True))
+            batch_op.create_index(batch_op.f('ix_photo_content_hash'), ['content_hash'], unique=False)
+
+    if 'content_hash' not in {column['name'] for column in inspector.get_columns('ingest_job')}:
+        with op.batch_alter_table('ingest_job', schema=None) as batch_op:
+            batch_op.add_column(sa.Column('content_hash', sa.String(length=64), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('ingest_job', schema=None) as batch_op:
+        batch_op.drop_column('content_hash')
+
+    with op.batch_alter_table('photo', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_photo_content_hash'))
+        batch_op.drop_column('content_hash')
+
+    op.drop_table('encoding_memo')
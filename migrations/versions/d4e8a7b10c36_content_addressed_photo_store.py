@@ -0,0 +1,82 @@
+"""Move case photos into the content-addressed, sharded photo store
+
+Revision ID: d4e8a7b10c36
+Revises: b93f6e1c8d24
+Create Date: 2026-10-17 14:47:51.163092
+
+"""
+import hashlib
+import os
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4e8a7b10c36'
+down_revision = 'b93f6e1c8d24'
+branch_labels = None
+depends_on = None
+
+# Kept in sync with utils/photo_store.py by hand: migrations must not change when it does
+PHOTO_DIR = 'data/faces'
+
+photo = sa.table(
+    'photo',
+    sa.column('id', sa.Integer),
+    sa.column('filename', sa.String),
+    sa.column('content_hash', sa.String),
+)
+
+
+def _sharded_name(path):
+    with open(path, 'rb') as f:
+        head = f.read(8)
+        digest = hashlib.sha256(head)
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    key = digest.hexdigest()
+    extension = '.png' if head == b'\x89PNG\r\n\x1a\n' else '.jpg'
+    return f'{key[:2]}/{key[2:4]}/{key}{extension}', key
+
+
+def _move(source, target):
+    if os.path.exists(target):
+        os.remove(source)  # Byte-identical copy already moved
+    else:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(source, target)
+
+
+def upgrade():
+    conn = op.get_bind()
+    rows = conn.execute(sa.select(photo.c.id, photo.c.filename)).fetchall()
+    moved = {}
+    for row in rows:
+        if '/' in row.filename:
+            continue  # Already in the store
+        source = os.path.join(PHOTO_DIR, row.filename)
+        if row.filename in moved:
+            name, key = moved[row.filename]
+        elif os.path.exists(source):
+            name, key = _sharded_name(source)
+            _move(source, os.path.join(PHOTO_DIR, *name.split('/')))
+            moved[row.filename] = (name, key)
+        else:
+            print(f'Photo {row.id}: {source} is missing, leaving it in place')
+            continue
+        conn.execute(photo.update().where(photo.c.id == row.id).values(filename=name, content_hash=key))
+
+
+def downgrade():
+    # Back to a flat directory; files are named after their content hash
+    conn = op.get_bind()
+    rows = conn.execute(sa.select(photo.c.id, photo.c.filename)).fetchall()
+    for row in rows:
+        if '/' not in row.filename:
+            continue
+        flat_name = row.filename.rsplit('/', 1)[1]
+        source = os.path.join(PHOTO_DIR, *row.filename.split('/'))
+        if os.path.exists(source):
+            _move(source, os.path.join(PHOTO_DIR, flat_name))
+        conn.execute(photo.update().where(photo.c.id == row.id).values(filename=flat_name))
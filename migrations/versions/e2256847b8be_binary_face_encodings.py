@@ -0,0 +1,92 @@
+"""Store face encodings as binary float32 blobs
+
+Revision ID: e2256847b8be
+Revises: 00b213273b55
+Create Date: 2026-10-17 09:12:41.518204
+
+"""
+import json
+import time
+
+from alembic import op
+import numpy as np
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2256847b8be'
+down_revision = '00b213273b55'
+branch_labels = None
+depends_on = None
+
+# Rows converted per transaction; each batch holds the SQLite write lock only briefly
+BATCH_SIZE = 500
+# Pause between batches so the running app can get its own writes in
+BATCH_PAUSE = 0.05
+
+photo = sa.table(
+    'photo',
+    sa.column('id', sa.Integer),
+    sa.column('face_encoding', sa.Text),
+    sa.column('face_encoding_blob', sa.LargeBinary),
+)
+
+
+def _json_to_blob(row):
+    blob = np.asarray(json.loads(row.face_encoding), dtype='<f4').tobytes()
+    return {'face_encoding_blob': blob, 'face_encoding': None}
+
+
+def _blob_to_json(row):
+    encoding = np.frombuffer(row.face_encoding_blob, dtype='<f4')
+    return {'face_encoding_blob': None, 'face_encoding': json.dumps(encoding.tolist())}
+
+
+def _convert_in_batches(engine, source_column, convert):
+    """Rewrite every row with a non-null `source_column`, one short transaction per batch."""
+    last_id = 0
+    while True:
+        with engine.connect() as conn:
+            rows = conn.execute(
+                sa.select(photo.c.id, photo.c.face_encoding, photo.c.face_encoding_blob)
+                .where(photo.c.id > last_id)
+                .where(source_column.isnot(None))
+                .order_by(photo.c.id)
+                .limit(BATCH_SIZE)
+            ).fetchall()
+        if not rows:
+            break
+
+        params = []
+        for row in rows:
+            values = convert(row)
+            values['b_id'] = row.id
+            params.append(values)
+        with engine.begin() as conn:
+            conn.execute(
+                photo.update()
+                .where(photo.c.id == sa.bindparam('b_id'))
+                .values(
+                    face_encoding=sa.bindparam('face_encoding'),
+                    face_encoding_blob=sa.bindparam('face_encoding_blob'),
+                ),
+                params,
+            )
+        last_id = rows[-1].id
+        time.sleep(BATCH_PAUSE)
+
+
+def upgrade():
+    op.add_column('photo', sa.Column('face_encoding_blob', sa.LargeBinary(), nullable=True))
+
+    # Commit the new column, then convert existing rows outside the migration transaction
+    with op.get_context().autocommit_block():
+        _convert_in_batches(op.get_bind().engine, photo.c.face_encoding, _json_to_blob)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        _convert_in_batches(op.get_bind().engine, photo.c.face_encoding_blob, _blob_to_json)
+
+    with op.batch_alter_table('photo') as batch_op:
+        batch_op.drop_column('face_encoding_blob')
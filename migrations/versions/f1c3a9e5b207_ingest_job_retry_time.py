@@ -0,0 +1,28 @@
+"""Earliest retry time for re-queued ingest jobs
+
+Revision ID: f1c3a9e5b207
+Revises: d4e8a7b10c36
+Create Date: 2026-10-17 18:05:12.418306
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f1c3a9e5b207'
+down_revision = 'd4e8a7b10c36'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    if 'retry_at' not in {column['name'] for column in inspector.get_columns('ingest_job')}:
+        with op.batch_alter_table('ingest_job', schema=None) as batch_op:
+            batch_op.add_column(sa.Column('retry_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('ingest_job', schema=None) as batch_op:
+        batch_op.drop_column('retry_at')
@@ -28,14 +28,37 @@ class Case(db.Model):
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     reporter_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     photos = db.relationship('Photo', backref='case', lazy=True)
+    ingest_jobs = db.relationship('IngestJob', backref='case', lazy=True, cascade='all, delete-orphan')
 
 class Photo(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    filename = db.Column(db.String(200), nullable=False)
-    face_encoding = db.Column(db.Text, nullable=True)  # Store face encoding as JSON string
+    filename = db.Column(db.String(200), nullable=False)  # PhotoStore name (ab/cd/<sha256>.jpg)
+    face_encoding = db.Column(db.Text, nullable=True)  # Legacy JSON encoding, kept until rows are migrated
+    face_encoding_blob = db.Column(db.LargeBinary, nullable=True)  # Raw float32 face encoding (512 bytes)
+    content_hash = db.Column(db.String(64), nullable=True, index=True)  # SHA-256 of the image bytes
     case_id = db.Column(db.Integer, db.ForeignKey('case.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+class IngestJob(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    case_id = db.Column(db.Integer, db.ForeignKey('case.id'), nullable=False)
+    filename = db.Column(db.String(200), nullable=False)  # Staged upload under data/uploads
+    original_name = db.Column(db.String(200), nullable=True)
+    content_hash = db.Column(db.String(64), nullable=True)
+    status = db.Column(db.String(20), default='pending', index=True)  # 'pending', 'processing', 'done' or 'failed'
+    error = db.Column(db.String(200), nullable=True)
+    attempts = db.Column(db.Integer, default=0)
+    retry_at = db.Column(db.DateTime, nullable=True)  # A re-queued job is not claimed before this
+    photo_id = db.Column(db.Integer, nullable=True)  # Photo created from this upload
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class EncodingMemo(db.Model):
+    content_hash = db.Column(db.String(64), primary_key=True)  # SHA-256 of the image bytes
+    face_count = db.Column(db.Integer, nullable=False)  # Faces the detector found
+    face_encoding_blob = db.Column(db.LargeBinary, nullable=True)  # Set when exactly one face was encoded
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
 class Activity(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     action = db.Column(db.String(50), nullable=False)
@@ -1,117 +1,115 @@
-from flask import Blueprint, request, jsonify
-from models.case import Case
-from models.person import Person
-from utils.face_recognition import compare_faces
-from utils.sms_service import send_match_notification, TabaarakSMS
+from flask import Blueprint, request, jsonify, current_app
+from flask_login import login_required
+from concurrent.futures import TimeoutError as EncodingTimeout
+from models import db, Case
+from utils.encoding_service import EncodingServiceBusy
+from utils.sms_service import TabaarakSMS
 import base64
-import numpy as np
-import cv2
+import json
 from datetime import datetime
 
 api = Blueprint('api', __name__)
 
+def scan_pipeline():
+    """
+    The app's scan pipeline (encoding pool, shared gallery, guardian SMS),
+    registered in app.extensions['face_matching'] so this blueprint matches
+    exactly like /api/scan.
+    """
+    return current_app.extensions['face_matching']
+
+def request_location(data):
+    location = dict(data.get('location') or {})
+    location.setdefault('latitude', '0')
+    location.setdefault('longitude', '0')
+    location.setdefault('address', 'Unknown location')
+    location.setdefault('timestamp', datetime.now().isoformat())
+    return location
+
+def request_frame():
+    """
+    (image bytes, request data) for a scanned frame: a multipart `face_image`
+    JPEG with the location as a JSON `location` field, or the legacy JSON
+    body with a data URL `image`. The image is None if none was sent.
+    """
+    upload = request.files.get('face_image')
+    if upload:
+        try:
+            location = json.loads(request.form.get('location') or '{}')
+        except ValueError:
+            location = {}
+        return upload.read(), {'location': location if isinstance(location, dict) else {}}
+    data = request.get_json(silent=True) or {}
+    if not data.get('image'):
+        return None, data
+    return base64.b64decode(data['image'].split(',', 1)[-1]), data  # Drop the data URL prefix
+
 @api.route('/api/match_face', methods=['POST'])
+@login_required
 def match_face():
+    """
+    Match the face in a camera frame: one encoding of the probe and one
+    vectorised distance pass over the in-memory gallery.
+    """
     try:
-        data = request.json
-        image_data = data['image'].split(',')[1]  # Remove data URL prefix
-        location = data['location']
-        
-        # Convert base64 to image
-        nparr = np.frombuffer(base64.b64decode(image_data), np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        
-        # Get all open cases
-        open_cases = Case.query.filter_by(status='Open').all()
-        
-        for case in open_cases:
-            # Compare face with missing person's photo
-            if compare_faces(img, case.person.photo):
-                # Prepare person data for SMS
-                person_data = {
-                    'age': case.person.age,
-                    'gender': case.person.gender,
-                    'description': case.person.description,
-                    'last_seen': case.last_seen_at.strftime('%Y-%m-%d %H:%M') if case.last_seen_at else None
-                }
-                
-                # Automatically send notification to guardian using new SMS service
-                success, message, message_id = send_match_notification(
-                    case.guardian_phone,
-                    case.person.name,
-                    location,
-                    person_data
-                )
-                
-                if success:
-                    # Update case with location
-                    case.last_seen_location = f"{location['latitude']}, {location['longitude']}"
-                    case.last_seen_address = location['address']
-                    case.last_seen_at = datetime.fromisoformat(location['timestamp'])
-                    case.save()
-                
-                return jsonify({
-                    'match': True,
-                    'person': {
-                        'name': case.person.name,
-                        'case_id': case.id,
-                        'notification_sent': success,
-                        'notification_error': None if success else message,
-                        'message_id': message_id
-                    }
-                })
-        
-        return jsonify({'match': False})
-        
+        image_data, data = request_frame()
+        if not image_data:
+            return jsonify({'success': False, 'message': 'No image received.'}), 400
+        pipeline = scan_pipeline()
+
+        try:
+            encoded = pipeline['encode'](image_data, max_faces=1)
+        except (EncodingServiceBusy, EncodingTimeout):
+            return jsonify({'success': False, 'message': 'Scanner is busy. Please try again in a moment.'}), 503
+        if encoded is None:
+            return jsonify({'success': False, 'message': 'Failed to load image. Please try again.'}), 400
+        face_locations, face_encodings = encoded
+        if not face_locations:
+            return jsonify({'success': True, 'match': False, 'matches': [],
+                            'message': 'No face detected in the image.'})
+        if len(face_locations) > 1:
+            return jsonify({'success': True, 'match': False, 'matches': [],
+                            'message': 'Multiple faces detected. Please scan one face at a time.'})
+        if not face_encodings:
+            return jsonify({'success': True, 'match': False, 'matches': [],
+                            'message': 'Face encoding failed. Please try again with a clearer image.'})
+
+        matches, candidates = pipeline['match'](face_encodings, request_location(data))[0]
+        return jsonify({
+            'success': True,
+            'match': bool(matches),
+            'matches': matches,
+            'candidates': candidates,
+            'person': matches[0] if matches else None,
+            'message': None if matches else 'Not found person in our database.'
+        })
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        current_app.logger.error(f"Error in match_face: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
 
 @api.route('/api/notify_guardian', methods=['POST'])
+@login_required
 def notify_guardian():
     try:
-        data = request.json
-        case_id = data['case_id']
-        location = data['location']
-        
-        # Get case details
-        case = Case.query.get(case_id)
+        data = request.get_json(silent=True) or {}
+        case = db.session.get(Case, int(data.get('case_id', 0)))
         if not case:
             return jsonify({'success': False, 'error': 'Case not found'})
-        
-        # Prepare person data for SMS
-        person_data = {
-            'age': case.person.age,
-            'gender': case.person.gender,
-            'description': case.person.description,
-            'last_seen': case.last_seen_at.strftime('%Y-%m-%d %H:%M') if case.last_seen_at else None
-        }
-        
-        # Send SMS notification using new service
-        success, message, message_id = send_match_notification(
-            case.guardian_phone,
-            case.person.name,
-            location,
-            person_data
-        )
-        
+
+        success, message, message_id = scan_pipeline()['notify'](case, request_location(data))
         if success:
-            # Update case with location
-            case.last_seen_location = f"{location['latitude']}, {location['longitude']}"
-            case.last_seen_address = location['address']
-            case.last_seen_at = datetime.fromisoformat(location['timestamp'])
-            case.save()
-            
             return jsonify({
                 'success': True,
                 'message_id': message_id
             })
         else:
             return jsonify({'success': False, 'error': message})
-            
+
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @api.route('/api/sms/status/<message_id>', methods=['GET'])
+@login_required
 def check_sms_status(message_id):
     """
     Check the delivery status of an SMS message
@@ -119,7 +117,7 @@ def check_sms_status(message_id):
     try:
         sms_service = TabaarakSMS()
         status, details = sms_service.check_delivery_status(message_id)
-        
+
         return jsonify({
             'success': True,
             'status': status,
@@ -129,4 +127,4 @@ def check_sms_status(message_id):
         return jsonify({
             'success': False,
             'error': str(e)
-        }), 500 
\ No newline at end of file
+        }), 500
@@ -0,0 +1,87 @@
+import io
+import zipfile
+
+import pytest
+
+from utils.batch_archive import BatchTooLarge, UnsafeArchive, is_safe_entry_name, read_archive_images
+
+LIMITS = {'max_images': 3, 'max_entry_bytes': 1000, 'max_total_bytes': 2500}
+
+
+def archive(entries):
+    output = io.BytesIO()
+    with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for name, data in entries:
+            zf.writestr(zipfile.ZipInfo(name), data, compress_type=zipfile.ZIP_DEFLATED)
+    return output.getvalue()
+
+
+def read(entries, images=None, **limits):
+    return read_archive_images(archive(entries), images if images is not None else [],
+                               **dict(LIMITS, **limits))
+
+
+@pytest.fixture
+def reads(monkeypatch):
+    """Names of the entries actually decompressed."""
+    names = []
+    original = zipfile.ZipFile.read
+
+    def read(self, name, pwd=None):
+        names.append(getattr(name, 'filename', name))
+        return original(self, name, pwd)
+    monkeypatch.setattr(zipfile.ZipFile, 'read', read)
+    return names
+
+
+def test_images_are_read_and_other_entries_skipped():
+    images = read([('a.jpg', b'1'), ('notes.txt', b'2'), ('day1/b.PNG', b'3'), ('c.jpeg', b'4')])
+    assert images == [('a.jpg', b'1'), ('day1/b.PNG', b'3'), ('c.jpeg', b'4')]
+
+
+def test_member_count_limit(reads):
+    with pytest.raises(BatchTooLarge, match='At most 3 images'):
+        read([(f'{i}.jpg', b'x') for i in range(4)])
+    assert len(reads) == 3
+
+    # Files uploaded alongside the archive count too
+    with pytest.raises(BatchTooLarge):
+        read([('a.jpg', b'x'), ('b.jpg', b'x')], images=[('upload.jpg', b'x'), ('upload2.jpg', b'x')])
+
+
+def test_total_uncompressed_size_limit(reads):
+    # Zeros compress to almost nothing; the declared sizes are what counts
+    entries = [(f'{i}.jpg', bytes(900)) for i in range(3)]
+    assert len(archive(entries)) < 1000
+    with pytest.raises(BatchTooLarge, match='too large in total'):
+        read(entries)
+    assert reads == ['0.jpg', '1.jpg']  # Stopped before decompressing the entry that crosses the limit
+
+    with pytest.raises(BatchTooLarge):
+        read([('a.jpg', bytes(900))], images=[('upload.jpg', bytes(2000))])
+
+
+def test_oversized_entries_are_skipped(reads):
+    assert read([('big.jpg', bytes(1001)), ('small.jpg', b'x')]) == [('small.jpg', b'x')]
+    assert reads == ['small.jpg']
+
+
+@pytest.mark.parametrize('name', ['../evil.jpg', 'day1/../../evil.jpg', '/etc/evil.jpg', 'C:/evil.jpg',
+                                  'day1\\..\\evil.jpg', './evil.jpg', 'day1//evil.jpg'])
+def test_path_traversal_names_are_rejected(reads, name):
+    assert not is_safe_entry_name(name)
+    with pytest.raises(UnsafeArchive):
+        read([('fine.jpg', b'x'), (name, b'x')])
+    assert reads == []  # The whole archive is refused before anything is decompressed
+
+
+@pytest.mark.parametrize('name', ['inner.zip', 'day1/more.ZIP', 'photos.tar.gz'])
+def test_nested_archives_are_rejected(reads, name):
+    with pytest.raises(UnsafeArchive, match='is an archive'):
+        read([('fine.jpg', b'x'), (name, archive([('a.jpg', b'x')]))])
+    assert reads == []
+
+
+def test_not_a_zip():
+    with pytest.raises(zipfile.BadZipFile):
+        read_archive_images(b'not a zip', [], **LIMITS)
@@ -0,0 +1,56 @@
+import os
+import threading
+import time
+
+import pytest
+
+pytest.importorskip('cv2')
+pytest.importorskip('face_recognition')
+
+from utils import encoding_service
+from utils.encoding_service import EncodingService
+
+
+def _no_warmup():
+    pass
+
+
+def _worker_pid(data, detection, prefilter=False, max_faces=None, reuse=None):
+    """Stands in for encode_image: long enough that one worker cannot drain the batch alone."""
+    time.sleep(0.2)
+    return os.getpid()
+
+
+@pytest.fixture
+def pid_service(monkeypatch):
+    # Patched before the pool forks, so the workers run the stand-ins too
+    monkeypatch.setattr(encoding_service, '_warm_worker', _no_warmup)
+    monkeypatch.setattr(encoding_service, 'encode_image', _worker_pid)
+    service = EncodingService(workers=2, max_pending=4, timeout=30)
+    yield service
+    service.shutdown()
+
+
+def test_encode_many_spreads_a_batch_across_workers(pid_service):
+    pid_service.start()
+    # Larger than the queue, so the batch also waits on its own slots
+    pids = pid_service.encode_many([b'photo'] * 8, {'max_dimension': 1024}, max_faces=1)
+    assert all(isinstance(pid, int) for pid in pids)
+    assert os.getpid() not in pids
+    assert len(set(pids)) > 1
+
+
+def test_pool_started_from_a_thread_does_not_fork_it(pid_service):
+    # As a WSGI server's first request does; the workers come from a fork server instead
+    starter = threading.Thread(target=pid_service.start, kwargs={'fork': False})
+    starter.start()
+    starter.join()
+    assert pid_service._pool._mp_context.get_start_method() == encoding_service.LAZY_START_METHOD
+    pids = pid_service.encode_many([b'photo'] * 4, {'max_dimension': 640})
+    assert os.getpid() not in pids and all(isinstance(pid, int) for pid in pids)
+
+
+def test_inline_service_runs_in_the_calling_process(monkeypatch):
+    monkeypatch.setattr(encoding_service, 'encode_image', _worker_pid)
+    service = EncodingService(workers=0)
+    assert service.encode_many([b'photo'] * 2, {}) == [os.getpid()] * 2
@@ -0,0 +1,277 @@
+import multiprocessing
+import os
+
+import numpy as np
+import pytest
+
+from utils.ann_index import ANN_MIN_RECALL, IVFIndex, recall_against_exact
+from utils.face_gallery import ACTIVE_STATUS, FaceGallery
+from utils.gallery_snapshot import load_snapshot, save_snapshot
+from utils.shared_gallery import SharedGallery, _unlink_segment
+
+
+def random_encodings(n, seed=0):
+    return np.random.default_rng(seed).normal(size=(n, 128)).astype(np.float32)
+
+
+def build_gallery(encodings, photos_per_case=3, found_cases=()):
+    gallery = FaceGallery(capacity=4)  # Small, so adds exercise reallocation
+    for i, encoding in enumerate(encodings):
+        case_id = i // photos_per_case
+        gallery.add(i + 1, case_id, encoding, 'found' if case_id in found_cases else 'missing')
+    return gallery
+
+
+def assert_consistent(gallery):
+    """Row map and case index match the id columns, and both partitions are dense."""
+    n = len(gallery)
+    photo_ids = gallery._photo_ids[:n]
+    assert gallery._row_map() == {int(photo_id): row for row, photo_id in enumerate(photo_ids)}
+    cases = {}
+    for row, case_id in enumerate(gallery._case_ids[:n].tolist()):
+        cases.setdefault(case_id, set()).add(row)
+    assert gallery._case_index() == cases
+    assert len(set(photo_ids.tolist())) == n
+    statuses = gallery._statuses[:n]
+    assert (statuses[:gallery.active_size] == ACTIVE_STATUS).all()
+    assert (statuses[gallery.active_size:] != ACTIVE_STATUS).all()
+    encodings = gallery._encodings[:n]
+    assert np.allclose(gallery._sq_norms[:n], np.einsum('ij,ij->i', encodings, encodings), rtol=1e-5)
+
+
+def brute_force_top_cases(encodings, case_ids, query, k):
+    distances = np.linalg.norm(encodings - query, axis=1)
+    best = {}
+    for case_id, distance in zip(case_ids, distances):
+        best[case_id] = min(best.get(case_id, np.inf), distance)
+    return sorted(best, key=best.get)[:k]
+
+
+def test_partition_swaps_follow_case_status():
+    encodings = random_encodings(30)
+    gallery = build_gallery(encodings, found_cases={2, 5})
+    assert gallery.active_size == 24
+    assert_consistent(gallery)
+
+    gallery.set_case_status(3, 'found')
+    gallery.set_case_status(5, 'missing')
+    assert_consistent(gallery)
+    assert gallery.active_size == 24
+    active_cases = set(gallery._case_ids[:gallery.active_size].tolist())
+    assert 3 not in active_cases and 5 in active_cases
+
+    query = encodings[10]  # A photo of case 3
+    assert 3 not in [case_id for case_id, _, _ in gallery.top_cases(query, k=10)]
+    assert gallery.top_cases(query, k=1, include_archived=True)[0][:2] == (3, 11)
+
+
+def test_remove_by_swap_keeps_rows_dense():
+    encodings = random_encodings(40, seed=1)
+    gallery = build_gallery(encodings, found_cases={0, 7})
+    for photo_id in (1, 40, 17, 22, 5):
+        assert gallery.remove(photo_id)
+        assert_consistent(gallery)
+    assert not gallery.remove(17)
+    assert len(gallery) == 35
+    assert 17 not in gallery and 18 in gallery
+
+    # Replacing a photo in place keeps its row count and moves it with its new status
+    gallery.add(18, 5, encodings[0], 'found')
+    assert_consistent(gallery)
+    assert len(gallery) == 35
+
+
+def test_row_map_after_attach_and_mutation():
+    encodings = random_encodings(25, seed=2)
+    source = build_gallery(encodings, found_cases={1})
+    arrays = source.export_arrays()
+    for array in arrays.values():
+        array.flags.writeable = False
+
+    gallery = FaceGallery()
+    gallery.attach(arrays)
+    assert_consistent(gallery)
+    gallery.remove(3)
+    gallery.add(100, 50, encodings[3])
+    gallery.set_case_status(1, 'missing')
+    assert_consistent(gallery)
+    assert 3 not in gallery and 100 in gallery
+    # The attached (read-only) arrays were copied, not written to
+    assert np.array_equal(arrays['photo_ids'], source.export_arrays()['photo_ids'])
+
+
+def test_attach_reorders_status_interleaved_arrays():
+    encodings = random_encodings(6, seed=3)
+    arrays = {
+        'encodings': encodings,
+        'sq_norms': np.einsum('ij,ij->i', encodings, encodings).astype(np.float32),
+        'photo_ids': np.arange(1, 7, dtype=np.int64),
+        'case_ids': np.arange(6, dtype=np.int64),
+        'statuses': np.array([1, 0, 1, 0, 0, 1], dtype=np.int8),
+    }
+    gallery = FaceGallery()
+    gallery.attach(arrays)
+    assert gallery.active_size == 3
+    assert_consistent(gallery)
+
+
+@pytest.mark.parametrize('include_archived', [False, True])
+def test_top_cases_matches_brute_force(include_archived):
+    encodings = random_encodings(300, seed=4)
+    gallery = build_gallery(encodings, photos_per_case=4, found_cases=set(range(0, 75, 3)))
+    limit = len(gallery) if include_archived else gallery.active_size
+    stored = gallery._encodings[:limit]
+    case_ids = gallery._case_ids[:limit]
+    queries = encodings[::37] + 0.05
+
+    batched = gallery.top_cases_many(queries, k=5, include_archived=include_archived)
+    for query, many in zip(queries, batched):
+        single = gallery.top_cases(query, k=5, include_archived=include_archived)
+        expected = brute_force_top_cases(stored, case_ids, query, 5)
+        assert [case_id for case_id, _, _ in single] == expected
+        assert [case_id for case_id, _, _ in many] == expected
+        assert np.allclose([d for _, _, d in single], [d for _, _, d in many], atol=1e-4)
+
+
+def test_ann_state_travels_with_exported_arrays():
+    encodings = random_encodings(2000, seed=5)
+    writer = build_gallery(encodings, photos_per_case=2)
+    writer.enable_ann(IVFIndex(n_probe=8), min_size=1000)
+    arrays = writer.export_arrays()
+    assert len(arrays['lists']) == len(writer) and len(arrays['centroids'])
+
+    reader = FaceGallery()
+    reader.enable_ann(IVFIndex(n_probe=8), min_size=1000)
+
+    def fail(matrix):
+        raise AssertionError('readers must not train')
+    reader.ann.train = fail
+    reader.attach(arrays, writer.ann_trained_size)
+    assert reader._ann_rows(encodings[0], reader.active_size) is not None
+    assert reader.top_cases(encodings[7], k=1)[0][:2] == (3, 8)
+
+
+def test_ann_recall_meets_the_cli_threshold():
+    # Faces cluster: people scatter around a few hundred look-alike groups, photos around each person
+    rng = np.random.default_rng(8)
+    groups = rng.normal(0, 0.1, (256, 128))
+    people = groups[rng.integers(0, len(groups), 3000)] + rng.normal(0, 0.05, (3000, 128))
+    encodings = (np.repeat(people, 2, axis=0) + rng.normal(0, 0.01, (6000, 128))).astype(np.float32)
+    gallery = build_gallery(encodings, photos_per_case=2)
+    gallery.enable_ann(IVFIndex(), min_size=0)
+    gallery.prepare_ann()
+
+    # Same queries as check-ann-recall: stored encodings perturbed like fresh photos
+    queries = encodings[rng.choice(len(encodings), 200, replace=False)]
+    queries = queries + rng.normal(0, 0.02, queries.shape).astype(np.float32)
+    assert len(gallery._ann_rows(queries[0], gallery.active_size)) < len(gallery) // 2
+    assert recall_against_exact(gallery, queries, k=5) >= ANN_MIN_RECALL
+
+
+def test_snapshot_round_trip(tmp_path):
+    encodings = random_encodings(50, seed=6)
+    gallery = build_gallery(encodings, found_cases={4})
+    save_snapshot(gallery, str(tmp_path), fingerprint=[50, 50, 1])
+    arrays, manifest = load_snapshot(str(tmp_path))
+    assert manifest['fingerprint'] == [50, 50, 1]
+
+    loaded = FaceGallery()
+    loaded.attach(arrays)
+    assert_consistent(loaded)
+    assert loaded.active_size == gallery.active_size
+    query = encodings[20] + 0.01
+    assert loaded.top_cases(query, k=3) == gallery.top_cases(query, k=3)
+
+
+def test_in_place_status_change_writes_only_swapped_rows(shared_gallery):
+    encodings = random_encodings(200, seed=9)
+    with shared_gallery.writer(fingerprint=[200, 200, 1]) as gallery:
+        for i, encoding in enumerate(encodings):
+            gallery.add(i + 1, i // 4, encoding, 'found' if i % 3 == 0 else 'missing')
+    arrays = shared_gallery._arrays
+    before = {name: array.copy() for name, array in arrays.items()}
+    case_rows = set(gallery.case_rows(7).tolist())
+
+    shared_gallery.set_case_status(7, 'found', fingerprint=[200, 200, 2])
+    assert gallery.serves_from(arrays)  # Still the shared segment, not private copies
+    assert not arrays['photo_ids'].flags.writeable
+    assert_consistent(gallery)
+    changed = set(np.flatnonzero(before['photo_ids'] != arrays['photo_ids']).tolist())
+    # Each of the case's photos swaps with at most one row at the partition boundary
+    assert changed and len(changed) <= 2 * len(case_rows)
+    assert 7 not in {case_id for case_id, _, _ in gallery.top_cases(encodings[29], k=20)}
+
+    # A private copy of the gallery falls back to a full publish
+    with shared_gallery.writer(fingerprint=[201, 201, 2]) as gallery:
+        gallery.add(1000, 7, encodings[0])
+    gallery.add(1001, 8, encodings[1])
+    shared_gallery.set_case_status(8, 'found', fingerprint=[202, 202, 3])
+    assert gallery.serves_from(shared_gallery._arrays)
+    assert_consistent(gallery)
+
+
+def _reader_process(lock_path, steps, results):
+    """Attach to the shared gallery, then report what each refresh shows."""
+    gallery = FaceGallery()
+    shared = SharedGallery(gallery, lock_path=lock_path)
+    query = random_encodings(1, seed=7)[0]
+    for _ in range(3):
+        steps.get(timeout=30)
+        top = shared.scan(lambda: gallery.top_cases(query, k=1))
+        results.put((shared.generation, shared.fingerprint, len(gallery), top))
+    shared.close()
+
+
+@pytest.fixture
+def shared_gallery(tmp_path):
+    shared = SharedGallery(FaceGallery(), lock_path=str(tmp_path / 'gallery.lock'))
+    yield shared
+    names = [f'{shared._prefix}_ctl']
+    if shared._segment is not None:
+        names.append(shared._segment.name)
+    shared.close()
+    for name in names:
+        _unlink_segment(name)
+
+
+def test_shared_gallery_publish_and_refresh_across_processes(shared_gallery):
+    if not hasattr(os, 'fork'):
+        pytest.skip('needs fork')
+    context = multiprocessing.get_context('fork')
+    steps, results = context.Queue(), context.Queue()
+    reader = context.Process(target=_reader_process, args=(shared_gallery.lock_path, steps, results))
+    reader.start()
+    try:
+        query = random_encodings(1, seed=7)[0]
+        with shared_gallery.writer(fingerprint=[10, 10, 1]) as gallery:
+            for i, encoding in enumerate(random_encodings(10, seed=8)):
+                gallery.add(i + 1, i, encoding)
+        steps.put('refresh')
+        generation, fingerprint, size, top = results.get(timeout=30)
+        assert (generation, fingerprint, size) == (shared_gallery.generation, [10, 10, 1], 10)
+        assert top == shared_gallery.gallery.top_cases(query, k=1)
+
+        # A later write, starting from the published generation, reaches the reader too
+        with shared_gallery.writer(fingerprint=[11, 11, 2]) as gallery:
+            gallery.add(11, 99, query)
+            gallery.set_case_status(0, 'found')
+        steps.put('refresh')
+        generation, fingerprint, size, top = results.get(timeout=30)
+        assert generation == shared_gallery.generation and fingerprint == [11, 11, 2]
+        assert size == 11
+        assert top[0][:2] == (99, 11)
+
+        # A status change rewrites rows of the current segment instead of publishing a new one
+        segment_name = shared_gallery._segment.name
+        shared_gallery.set_case_status(99, 'found', fingerprint=[11, 11, 3])
+        assert shared_gallery._segment.name == segment_name
+        steps.put('refresh')
+        generation, fingerprint, size, top = results.get(timeout=30)
+        assert generation == shared_gallery.generation and fingerprint == [11, 11, 3]
+        assert top[0][0] != 99
+        assert top == shared_gallery.gallery.top_cases(query, k=1)
+    finally:
+        reader.join(timeout=30)
+        if reader.is_alive():
+            reader.terminate()
+    assert reader.exitcode == 0
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('cv2')
+pytest.importorskip('face_recognition')
+
+from utils.face_gallery import FaceGallery
+from utils.face_recognition import compare_faces, match, match_many
+
+
+@pytest.fixture
+def known():
+    return np.random.default_rng(10).normal(size=(20, 128)).astype(np.float32)
+
+
+def brute_force(known, vector, k):
+    distances = np.linalg.norm(known - vector, axis=1)
+    return [int(i) for i in np.argsort(distances, kind='stable')[:k]], distances
+
+
+def test_match_many_against_an_array(known):
+    probes = known[[3, 11]] + 0.01
+    labels = [f'person-{i}' for i in range(len(known))]
+    results = match_many(probes, known, k=4, labels=labels)
+    assert len(results) == 2
+    for probe, ranked in zip(probes, results):
+        rows, distances = brute_force(known, probe, 4)
+        assert [row for _, row, _ in ranked] == rows
+        assert [label for label, _, _ in ranked] == [labels[row] for row in rows]
+        assert np.allclose([d for _, _, d in ranked], distances[rows], atol=1e-4)
+
+
+def test_match_against_a_gallery(known):
+    gallery = FaceGallery()
+    for i, encoding in enumerate(known):
+        gallery.add(i + 1, i // 2, encoding, 'found' if i // 2 == 4 else 'missing')
+    ranked = match(known[5].tolist(), gallery, k=3)  # A plain list is an encoding too
+    assert ranked[0][:2] == (2, 6) and ranked[0][2] == pytest.approx(0.0, abs=1e-2)
+    assert len({case_id for case_id, _, _ in ranked}) == 3
+
+    # Found cases are only searched on request
+    assert 4 not in [case_id for case_id, _, _ in match(known[8], gallery, k=10)]
+    assert match(known[8], gallery, k=1, include_archived=True)[0][:2] == (4, 9)
+    assert [r[0] for r in match_many(known[[1, 8]], gallery, k=1)] == [match(known[1], gallery, k=1)[0],
+                                                                     match(known[8], gallery, k=1)[0]]
+
+
+def test_k_larger_than_the_known_set(known):
+    assert len(match(known[0], known[:3], k=10)) == 3
+    assert len(match(known[0], FaceGallery(), k=10)) == 0
+
+
+@pytest.mark.parametrize('empty', [[], np.empty((0, 128), dtype=np.float32)])
+def test_empty_probes(known, empty):
+    assert match_many(empty, known) == []
+    assert match_many(empty, FaceGallery()) == []
+    assert match(empty, known) == []
+
+
+def test_compare_precomputed_encodings(known):
+    assert compare_faces(known[0], known[0] + 0.001) == (True, pytest.approx(1.0, abs=0.02))
+    is_match, accuracy = compare_faces(known[0], known[1])
+    assert not is_match and accuracy == 0.0
@@ -0,0 +1,115 @@
+import pytest
+
+from utils import face_tracking
+from utils.face_tracking import CONFIDENT_DISTANCE, FaceTracker, best_overlap, box_overlap
+
+# (top, right, bottom, left)
+FACE = (100, 200, 200, 100)
+NUDGED = (105, 205, 205, 105)  # IoU ~0.82 with FACE
+ELSEWHERE = (300, 500, 400, 400)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(face_tracking.time, 'monotonic', clock)
+    return clock
+
+
+class Matcher:
+    """match() stand-in: a fixed identity per encoding, recording how often it was asked."""
+
+    def __init__(self, identities):
+        self.identities = identities
+        self.calls = []
+
+    def __call__(self, encodings):
+        self.calls.append(list(encodings))
+        return [self.identities[encoding] for encoding in encodings]
+
+
+def test_box_overlap():
+    assert box_overlap(FACE, FACE) == 1.0
+    assert box_overlap(FACE, ELSEWHERE) == 0.0
+    assert box_overlap(FACE, NUDGED) == pytest.approx(95 * 95 / (2 * 100 * 100 - 95 * 95))
+    assert best_overlap(NUDGED, [ELSEWHERE, FACE]) == 1
+    assert best_overlap((100, 260, 200, 160), [FACE]) is None  # IoU 0.25
+
+
+def test_confident_face_keeps_its_identity_without_matching(clock):
+    tracker = FaceTracker()
+    match = Matcher({'alice': (7, 0.2)})
+    assert tracker.reusable('session') == []
+    tracks = tracker.update('session', [FACE], ['alice'], [], match)
+    assert [(t.case_id, t.distance, t.reused) for t in tracks] == [(7, 0.2, 0)]
+
+    # Next frame: the encoder skipped the face (None) because it overlaps a reusable box
+    reusable = tracker.reusable('session')
+    assert [t.box for t in reusable] == [FACE]
+    tracks = tracker.update('session', [NUDGED], [None], reusable, match)
+    assert [(t.box, t.case_id, t.reused) for t in tracks] == [(NUDGED, 7, 1)]
+    assert len(match.calls) == 1
+
+
+def test_moved_new_and_uncertain_faces_are_matched(clock):
+    tracker = FaceTracker()
+    match = Matcher({'alice': (7, 0.2), 'bob': (None, 0.9), 'carol': (8, CONFIDENT_DISTANCE + 0.05)})
+    tracker.update('session', [FACE, ELSEWHERE], ['alice', 'carol'], [], match)
+    # Only the confident identity is offered for reuse
+    reusable = tracker.reusable('session')
+    assert [t.case_id for t in reusable] == [7]
+
+    tracks = tracker.update('session', [ELSEWHERE, NUDGED], ['bob', None], reusable, match)
+    assert [(t.case_id, t.reused) for t in tracks] == [(None, 0), (7, 1)]
+    assert match.calls[-1] == ['bob']
+
+    # Skipped by the encoder but no reusable track overlaps any more: unknown, not a stale identity
+    tracks = tracker.update('session', [ELSEWHERE], [None], tracker.reusable('session'), match)
+    assert tracks[0].case_id is None and tracks[0].distance == float('inf')
+
+
+def test_identity_is_rechecked_after_max_reuse(clock):
+    tracker = FaceTracker(max_reuse=2)
+    match = Matcher({'alice': (7, 0.2), 'alice-again': (9, 0.1)})
+    tracker.update('session', [FACE], ['alice'], [], match)
+    for reused in (1, 2):
+        tracks = tracker.update('session', [FACE], [None], tracker.reusable('session'), match)
+        assert tracks[0].reused == reused
+    # Reused max_reuse times: the encoder must run again, and the face is re-identified
+    assert tracker.reusable('session') == []
+    tracks = tracker.update('session', [FACE], ['alice-again'], [], match)
+    assert (tracks[0].case_id, tracks[0].reused) == (9, 0)
+    assert tracker.reusable('session')[0].case_id == 9
+
+
+def test_sessions_expire(clock):
+    tracker = FaceTracker(ttl=30, max_sessions=2)
+    match = Matcher({'alice': (7, 0.2)})
+    tracker.update('a', [FACE], ['alice'], [], match)
+    clock.now += 31
+    assert tracker.reusable('a') == []
+
+    # Past max_sessions, stale sessions go first, then the least recently seen
+    clock.now += 1
+    tracker.update('b', [FACE], ['alice'], [], match)
+    clock.now += 1
+    tracker.update('c', [FACE], ['alice'], [], match)
+    assert set(tracker._sessions) == {'b', 'c'}
+    clock.now += 1
+    tracker.update('d', [FACE], ['alice'], [], match)
+    assert set(tracker._sessions) == {'c', 'd'}
+    assert tracker.reusable('c') and tracker.reusable('d')
+
+
+def test_sessions_are_separate(clock):
+    tracker = FaceTracker()
+    tracker.update('a', [FACE], ['alice'], [], Matcher({'alice': (7, 0.2)}))
+    assert tracker.reusable('b') == []
@@ -0,0 +1,81 @@
+import io
+import os
+
+import pytest
+
+pytest.importorskip('PIL')
+from PIL import Image
+
+from utils import image_io
+from utils.image_io import ORIENTATION_TAG, atomic_write, decode_image, decode_image_reduced, make_thumbnail
+
+
+def jpeg_bytes(image, orientation=None):
+    output = io.BytesIO()
+    exif = Image.Exif()
+    if orientation is not None:
+        exif[ORIENTATION_TAG] = orientation
+    image.save(output, format='JPEG', quality=90, exif=exif)
+    return output.getvalue()
+
+
+def half_red(width, height):
+    """White image whose left half is red, to tell which way it was rotated."""
+    image = Image.new('RGB', (width, height), 'white')
+    image.paste((255, 0, 0), (0, 0, width // 2, height))
+    return image
+
+
+@pytest.mark.parametrize('max_dimension', [640, 1024])
+def test_large_jpeg_is_decoded_reduced(max_dimension):
+    data = jpeg_bytes(half_red(4000, 3000))
+    array, original_shape = decode_image_reduced(data, max_dimension)
+    assert original_shape == (3000, 4000)
+    # The decoder only scales by powers of two: at least max_dimension, under twice that
+    assert max_dimension <= max(array.shape[:2]) < 2 * max_dimension
+    assert array.shape[0] * 4000 == array.shape[1] * 3000
+    assert decode_image(data).shape == (3000, 4000, 3)
+
+
+def test_thumbnail_fits_the_target_size():
+    thumbnail = Image.open(io.BytesIO(make_thumbnail(jpeg_bytes(half_red(3000, 4000)), 320)))
+    assert thumbnail.format == 'JPEG'
+    assert max(thumbnail.size) == 320
+
+
+def test_exif_rotated_jpeg_comes_back_upright():
+    # Stored landscape with the red half on the left; orientation 6 means "rotate 90 degrees clockwise"
+    data = jpeg_bytes(half_red(400, 200), orientation=6)
+    array, original_shape = decode_image_reduced(data)
+    assert array.shape == (400, 200, 3) and original_shape == (400, 200)
+    top, bottom = array[50, 100], array[350, 100]
+    assert top[0] > 200 and top[1] < 60  # Red now on top
+    assert bottom.min() > 200
+
+    # Reduced decodes report the upright size of the original too
+    array, original_shape = decode_image_reduced(jpeg_bytes(half_red(4000, 2000), orientation=6), 640)
+    assert original_shape == (4000, 2000)
+    assert array.shape[0] > array.shape[1] and 640 <= array.shape[0] < 1280
+
+
+def test_png_and_unreadable_data():
+    output = io.BytesIO()
+    half_red(300, 100).save(output, format='PNG')
+    assert decode_image(output.getvalue(), 64).shape == (100, 300, 3)  # No reduced decode for PNG
+    assert decode_image(b'not an image') is None
+    assert decode_image_reduced(b'') == (None, None)
+    assert make_thumbnail(b'not an image', 100) is None
+
+
+def test_oversized_images_are_refused(monkeypatch):
+    monkeypatch.setattr(image_io, 'MAX_DECODE_PIXELS', 1000)
+    assert decode_image(jpeg_bytes(half_red(100, 100))) is None
+
+
+def test_atomic_write_replaces_without_leftovers(tmp_path):
+    path = str(tmp_path / 'nested' / 'photo.jpg')
+    atomic_write(path, b'first')
+    atomic_write(path, b'second')
+    with open(path, 'rb') as f:
+        assert f.read() == b'second'
+    assert os.listdir(os.path.dirname(path)) == ['photo.jpg']
@@ -0,0 +1,93 @@
+import hashlib
+import io
+import os
+
+import pytest
+
+pytest.importorskip('PIL')
+from PIL import Image
+
+from utils.photo_store import PhotoStore, content_hash
+
+
+def image_bytes(color, format='JPEG'):
+    output = io.BytesIO()
+    Image.new('RGB', (64, 48), color).save(output, format=format)
+    return output.getvalue()
+
+
+@pytest.fixture
+def store(tmp_path):
+    return PhotoStore(str(tmp_path / 'faces'))
+
+
+def stored_files(store):
+    return sorted(os.path.relpath(os.path.join(directory, name), store.root)
+                  for directory, _, names in os.walk(store.root) for name in names)
+
+
+def test_names_are_sharded_by_content_hash(store):
+    data = image_bytes('red')
+    key = hashlib.sha256(data).hexdigest()
+    name = store.put(data)
+    assert key == content_hash(data)
+    assert name == f'{key[:2]}/{key[2:4]}/{key}.jpg'
+    assert store.path(name) == os.path.join(store.root, key[:2], key[2:4], f'{key}.jpg')
+    assert store.key_of(name) == key
+    assert store.read(name) == data
+    assert store.put(image_bytes('red', 'PNG')).endswith('.png')
+
+
+def test_identical_bytes_are_stored_once(store, tmp_path):
+    data = image_bytes('blue')
+    name = store.put(data)
+    assert store.put(data) == name
+
+    # A staged upload with the same content is dropped rather than stored again
+    staged = tmp_path / 'upload.tmp'
+    staged.write_bytes(data)
+    assert store.put_file(str(staged)) == name
+    assert not staged.exists()
+    assert stored_files(store) == [os.path.join(*name.split('/'))]
+
+    other = tmp_path / 'other.tmp'
+    other.write_bytes(image_bytes('green'))
+    assert store.put_file(str(other), content_hash(other.read_bytes())) != name
+    assert len(stored_files(store)) == 2
+
+
+def test_thumbnails_are_cached_and_deleted_with_the_photo(store):
+    name = store.put(image_bytes('red', 'PNG'))
+    thumb = store.thumbnail_path(name, 32)
+    assert thumb.startswith(os.path.join(store.root, 'thumbs', '32')) and thumb.endswith('.jpg')
+    assert max(Image.open(thumb).size) == 32
+    assert store.thumbnail_path(name, 32) == thumb
+
+    store.delete(name)
+    assert not store.exists(name) and not os.path.exists(thumb)
+    assert store.thumbnail_path(name, 32) is None
+    store.delete(name)  # Already gone
+
+
+@pytest.mark.parametrize('name', ['../secret.jpg', 'ab/../../secret.jpg', '/etc/passwd',
+                                  'ab//cd.jpg', 'ab\\..\\secret.jpg', 'ab/cd/..'])
+def test_names_cannot_leave_the_store(store, tmp_path, name):
+    (tmp_path / 'secret.jpg').write_bytes(image_bytes('red'))
+    assert not store.exists(name)
+    with pytest.raises(ValueError):
+        store.path(name)
+    with pytest.raises(ValueError):
+        store.read(name)
+    with pytest.raises(ValueError):
+        store.thumbnail_path(name, 32)
+    with pytest.raises(ValueError):
+        store.delete(name)
+    assert (tmp_path / 'secret.jpg').exists()
+
+
+def test_legacy_flat_names_still_resolve(store):
+    os.makedirs(store.root)
+    with open(os.path.join(store.root, 'legacy.jpg'), 'wb') as f:
+        f.write(image_bytes('red'))
+    assert store.exists('legacy.jpg')
+    assert store.path('legacy.jpg') == os.path.join(store.root, 'legacy.jpg')
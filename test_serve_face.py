@@ -0,0 +1,95 @@
+import io
+import os
+
+import pytest
+
+for module in ('cv2', 'face_recognition', 'flask', 'flask_sqlalchemy', 'PIL'):
+    pytest.importorskip(module)
+from PIL import Image
+
+from utils.shared_gallery import _unlink_segment
+
+
+@pytest.fixture(scope='module')
+def app_module(tmp_path_factory):
+    """The app, importing with its database and data directories under a temporary directory."""
+    root = tmp_path_factory.mktemp('app')
+    cwd = os.getcwd()
+    os.environ['DATABASE_URL'] = f'sqlite:///{root / "test.db"}'
+    os.chdir(root)
+    try:
+        import app as app_module
+        app_module.PHOTO_STORE.root = str(root / 'faces')
+        app_module.BACKGROUND_STARTED = True  # No encoding pools or worker threads for these requests
+        yield app_module
+    finally:
+        shared = app_module.SHARED_GALLERY
+        names = [f'{shared._prefix}_ctl'] + ([shared._segment.name] if shared._segment is not None else [])
+        shared.close()
+        for name in names:
+            _unlink_segment(name)
+        os.chdir(cwd)
+        del os.environ['DATABASE_URL']
+
+
+@pytest.fixture(scope='module')
+def client(app_module):
+    from models import db, User
+    with app_module.app.app_context():
+        user = User(username='viewer', email='viewer@example.com', password='x', role='user')
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+    client = app_module.app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+    return client
+
+
+@pytest.fixture(scope='module')
+def photo_name(app_module):
+    output = io.BytesIO()
+    Image.new('RGB', (640, 480), 'red').save(output, format='JPEG')
+    return app_module.PHOTO_STORE.put(output.getvalue())
+
+
+def test_photo_is_served_with_a_content_etag(app_module, client, photo_name):
+    response = client.get(f'/face/{photo_name}')
+    assert response.status_code == 200
+    assert response.get_etag() == (app_module.PHOTO_STORE.key_of(photo_name), False)
+    cache_control = response.cache_control
+    assert cache_control.immutable and cache_control.private and not cache_control.public
+    assert cache_control.max_age == app_module.PHOTO_MAX_AGE
+
+
+def test_matching_if_none_match_gets_304(app_module, client, photo_name):
+    etag = client.get(f'/face/{photo_name}').headers['ETag']
+    response = client.get(f'/face/{photo_name}', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert not response.data
+    assert response.headers['ETag'] == etag
+    assert client.get(f'/face/{photo_name}', headers={'If-None-Match': '"other"'}).status_code == 200
+
+
+def test_thumbnail_has_its_own_etag(app_module, client, photo_name):
+    response = client.get(f'/face/{photo_name}?size=thumb')
+    assert response.status_code == 200
+    assert response.get_etag()[0] == f'{app_module.PHOTO_STORE.key_of(photo_name)}-thumb'
+    assert response.cache_control.immutable
+    assert max(Image.open(io.BytesIO(response.data)).size) == app_module.PHOTO_VARIANTS['thumb']
+    etag = response.headers['ETag']
+    assert client.get(f'/face/{photo_name}?size=thumb', headers={'If-None-Match': etag}).status_code == 304
+
+
+@pytest.mark.parametrize('path', ['/face/00/00/missing.jpg', '/face/../test.db', '/face/%2e%2e/test.db'])
+def test_missing_and_unsafe_names_are_not_found(client, photo_name, path):
+    assert client.get(path).status_code == 404
+
+
+def test_unknown_size_is_not_found(client, photo_name):
+    assert client.get(f'/face/{photo_name}?size=huge').status_code == 404
+
+
+def test_photos_need_a_login(app_module, photo_name):
+    assert app_module.app.test_client().get(f'/face/{photo_name}').status_code == 302
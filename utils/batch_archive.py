@@ -0,0 +1,55 @@
+import io
+import zipfile
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+# Entries refused outright rather than skipped: a batch is one level of images
+NESTED_ARCHIVE_EXTENSIONS = ('.zip', '.jar', '.tar', '.tgz', '.gz', '.bz2', '.xz', '.7z', '.rar')
+
+
+class BatchTooLarge(Exception):
+    """Raised while reading a batch upload once it holds too many images or bytes."""
+
+
+class UnsafeArchive(Exception):
+    """Raised for an archive holding other archives or entries whose names could leave a directory."""
+
+
+def is_safe_entry_name(name):
+    """True for a plain relative path: no absolute or drive prefix, backslashes, or '.'/'..' components."""
+    if not name or name.startswith('/') or '\\' in name or ':' in name or '\0' in name:
+        return False
+    return not any(part in ('', '.', '..') for part in name.rstrip('/').split('/'))
+
+
+def read_archive_images(data, images, max_images, max_entry_bytes, max_total_bytes):
+    """
+    Append (filename, bytes) for each image entry of the zip archive `data`
+    to `images`, which may already hold other uploads of the same batch.
+    Entries that are not images, or declare more than `max_entry_bytes`,
+    are skipped. Raises UnsafeArchive for nested archives or unsafe names,
+    and BatchTooLarge as soon as the batch passes `max_images` or
+    `max_total_bytes`, before anything more is decompressed.
+    """
+    total_bytes = sum(len(image) for _, image in images)
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        entries = [info for info in zf.infolist() if not info.is_dir()]
+        # Check every name before decompressing anything
+        for info in entries:
+            if not is_safe_entry_name(info.filename):
+                raise UnsafeArchive(f"Archive entry {info.filename!r} is not a plain relative path.")
+            if info.filename.lower().endswith(NESTED_ARCHIVE_EXTENSIONS):
+                raise UnsafeArchive(f"Archive entry {info.filename!r} is an archive; upload its images directly.")
+        for info in entries:
+            if not info.filename.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            # The request size limit says nothing about how far an entry decompresses
+            if info.file_size > max_entry_bytes:
+                continue
+            if len(images) >= max_images:
+                raise BatchTooLarge(f"At most {max_images} images per batch.")
+            # file_size is the declared size; zipfile refuses to read past it
+            total_bytes += info.file_size
+            if total_bytes > max_total_bytes:
+                raise BatchTooLarge("Batch images are too large in total.")
+            images.append((info.filename, zf.read(info)))
+    return images
@@ -0,0 +1,196 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import cv2
+import numpy as np
+import face_recognition
+
+from utils.face_detection import detect_faces, rescale_locations
+from utils.face_tracking import MIN_OVERLAP, best_overlap
+from utils.image_io import decode_image_reduced
+
+# Haar cascade of this process, loaded once by _warm_worker (or on first inline use)
+_cascade = None
+
+# Pools not started explicitly may be created from a request thread; forking there would copy
+# locks other threads hold, so their workers come from a single-threaded fork server instead
+LAZY_START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+
+class EncodingServiceBusy(Exception):
+    """Raised when the encoding queue is full; callers should ask the client to retry."""
+
+
+def _load_cascade():
+    global _cascade
+    if _cascade is None:
+        _cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+    return _cascade
+
+
+def _warm_worker():
+    """Pool initializer: load the cascade and run dlib once so the first real task is not slow."""
+    _load_cascade()
+    blank = np.zeros((64, 64, 3), dtype=np.uint8)
+    face_recognition.face_locations(blank)
+    face_recognition.face_encodings(blank, [(8, 56, 56, 8)])
+
+
+def encode_image(data, detection, prefilter=False, max_faces=None, reuse=None):
+    """
+    Decode an encoded image (JPEG/PNG bytes), detect faces and encode them.
+    Returns None if the bytes are not an image, else (locations, encodings),
+    with locations in the coordinates of the uploaded image.
+    When more than `max_faces` faces are found the encodings are skipped and
+    returned empty, since the caller is going to reject the image anyway.
+
+    `reuse` lists boxes whose identity the caller already knows: a face that
+    overlaps one of them is not encoded and gets None in `encodings`.
+    """
+    # Decode at reduced resolution, at least max_dimension on the longest side: detection
+    # never looks at more pixels than that, and encoding works from these same pixels
+    rgb_image, original_shape = decode_image_reduced(data, detection.get('max_dimension'))
+    if rgb_image is None:
+        return None
+    cascade = _load_cascade() if prefilter else None
+    found = detect_faces(rgb_image, cascade=cascade, **detection)
+    locations = rescale_locations(found, rgb_image.shape, original_shape)
+    if not found or (max_faces is not None and len(found) > max_faces):
+        return locations, []
+    if not reuse:
+        return locations, face_recognition.face_encodings(rgb_image, found)
+    known = [best_overlap(location, reuse, MIN_OVERLAP) is not None for location in locations]
+    fresh = [box for box, skip in zip(found, known) if not skip]
+    fresh_encodings = iter(face_recognition.face_encodings(rgb_image, fresh) if fresh else [])
+    return locations, [None if skip else next(fresh_encodings) for skip in known]
+
+
+class EncodingService:
+    """
+    Runs encode_image in a pool of pre-warmed worker processes, so dlib's
+    CPU-bound work neither holds the GIL in the web process nor blocks its
+    request threads, and spreads across every core.
+
+    At most `max_pending` tasks may be queued or running; past that, submit
+    raises EncodingServiceBusy instead of letting requests pile up. `timeout`
+    bounds how long a caller waits for one result. With `workers=0` tasks run
+    inline in the calling thread.
+    """
+
+    def __init__(self, workers=None, max_pending=32, timeout=30):
+        self.workers = multiprocessing.cpu_count() if workers is None else workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def start(self, fork=True):
+        """
+        Start and warm the worker processes now. By default they are forked
+        from this process, which is only safe before it runs other threads,
+        e.g. from the server's entry point. With `fork=False` they come from
+        a fork server, as for a pool created on first use.
+        """
+        if self.workers:
+            self._executor('fork' if fork else LAZY_START_METHOD).submit(int).result()
+
+    def _executor(self, start_method=LAZY_START_METHOD):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context(start_method),
+                                                 initializer=_warm_worker)
+            return self._pool
+
+    def _reset(self, pool):
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False)
+
+    def submit(self, data, detection, prefilter=False, max_faces=None, block=False, reuse=None):
+        """
+        Queue one image; returns a Future for encode_image's result. With
+        `block`, wait up to `timeout` for a free queue slot instead of failing.
+        """
+        if block:
+            acquired = self._slots.acquire(timeout=self.timeout)
+        else:
+            acquired = self._slots.acquire(blocking=False)
+        if not acquired:
+            raise EncodingServiceBusy('Encoding queue is full')
+        try:
+            if not self.workers:
+                future = _InlineFuture(encode_image, data, detection, prefilter, max_faces, reuse)
+            else:
+                pool = self._executor()
+                try:
+                    future = pool.submit(encode_image, data, detection, prefilter, max_faces, reuse)
+                except BrokenProcessPool:
+                    # A worker died (e.g. OOM); replace the pool and retry once
+                    self._reset(pool)
+                    future = self._executor().submit(encode_image, data, detection, prefilter, max_faces, reuse)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def result(self, future):
+        """Wait at most `timeout` seconds; raises concurrent.futures.TimeoutError past that."""
+        return future.result(timeout=self.timeout)
+
+    def encode(self, data, detection, prefilter=False, max_faces=None, block=False, reuse=None):
+        return self.result(self.submit(data, detection, prefilter, max_faces, block, reuse))
+
+    def encode_many(self, images, detection, prefilter=False, max_faces=None):
+        """
+        Encode several images concurrently. Returns one result per image, in
+        order; an image whose task failed or timed out gets its exception
+        instead of a result. A batch larger than the queue waits for its own
+        earlier images to free slots.
+        """
+        futures = []
+        for data in images:
+            try:
+                futures.append(self.submit(data, detection, prefilter, max_faces, block=True))
+            except EncodingServiceBusy as e:
+                futures.append(e)
+        results = []
+        for future in futures:
+            if isinstance(future, Exception):
+                results.append(future)
+                continue
+            try:
+                results.append(self.result(future))
+            except Exception as e:
+                results.append(e)
+        return results
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True)
+
+
+class _InlineFuture:
+    """Already-completed stand-in for a Future when the service runs without workers."""
+
+    def __init__(self, fn, *args):
+        self._result = None
+        self._error = None
+        try:
+            self._result = fn(*args)
+        except Exception as e:
+            self._error = e
+
+    def add_done_callback(self, callback):
+        callback(self)
+
+    def result(self, timeout=None):
+        if self._error is not None:
+            raise self._error
+        return self._result
@@ -0,0 +1,102 @@
+import cv2
+import numpy as np
+import face_recognition
+
+
+def _scale_location(location, scale, height, width):
+    """Map a (top, right, bottom, left) box from a resized image back to full resolution."""
+    top, right, bottom, left = location
+    return (
+        max(0, int(round(top / scale))),
+        min(width, int(round(right / scale))),
+        min(height, int(round(bottom / scale))),
+        max(0, int(round(left / scale))),
+    )
+
+
+def rescale_locations(locations, shape, original_shape):
+    """Map boxes found in an image of `shape` to the (height, width) `original_shape` it was reduced from."""
+    height, width = original_shape
+    if shape[:2] == (height, width):
+        return locations
+    scale = max(shape[:2]) / float(max(height, width))
+    return [_scale_location(location, scale, height, width) for location in locations]
+
+
+def _resize_to(image, max_dimension):
+    """`image` shrunk so its longest side is at most `max_dimension`, plus the scale used."""
+    height, width = image.shape[:2]
+    if not max_dimension or max(height, width) <= max_dimension:
+        return image, 1.0
+    scale = max_dimension / float(max(height, width))
+    small = cv2.resize(image, (max(1, int(width * scale)), max(1, int(height * scale))),
+                       interpolation=cv2.INTER_AREA)
+    return small, scale
+
+
+def _merge_regions(regions):
+    """Union overlapping (top, right, bottom, left) regions so no face is searched twice."""
+    merged = list(regions)
+    changed = True
+    while changed:
+        changed = False
+        for i in range(len(merged)):
+            for j in range(i + 1, len(merged)):
+                a, b = merged[i], merged[j]
+                if a[0] < b[2] and b[0] < a[2] and a[3] < b[1] and b[3] < a[1]:
+                    merged[i] = (min(a[0], b[0]), max(a[1], b[1]), max(a[2], b[2]), min(a[3], b[3]))
+                    del merged[j]
+                    changed = True
+                    break
+            if changed:
+                break
+    return merged
+
+
+def haar_candidates(rgb_image, cascade, thumb_dimension=320, margin=0.5):
+    """
+    Regions that may contain a face, found by a Haar cascade on a small
+    grayscale thumbnail. Each hit is grown by `margin` (a fraction of its
+    size) on every side so dlib gets enough context, and overlapping regions
+    are merged. Returns full-resolution (top, right, bottom, left) boxes.
+    """
+    height, width = rgb_image.shape[:2]
+    thumb, scale = _resize_to(rgb_image, thumb_dimension)
+    gray = cv2.cvtColor(thumb, cv2.COLOR_RGB2GRAY)
+    hits = cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=4, minSize=(20, 20))
+    regions = []
+    for x, y, w, h in hits:
+        pad_x, pad_y = w * margin, h * margin
+        regions.append(_scale_location((y - pad_y, x + w + pad_x, y + h + pad_y, x - pad_x),
+                                       scale, height, width))
+    return _merge_regions(regions)
+
+
+def detect_faces(rgb_image, max_dimension=None, upsample=1, model='hog', cascade=None):
+    """
+    Face boxes in (top, right, bottom, left) coordinates of `rgb_image`.
+
+    The detector runs on a copy whose longest side is at most `max_dimension`
+    pixels (None keeps the original size); HOG cost grows with pixel count,
+    so a 12 MP phone photo is far cheaper to search at ~1000 px. `upsample`
+    and `model` ('hog' or 'cnn') are passed straight to dlib.
+
+    With a Haar `cascade`, frames in which it finds nothing are rejected
+    without running dlib at all, and dlib only searches the regions it found.
+    """
+    if cascade is not None and not cascade.empty():
+        locations = []
+        for top, right, bottom, left in haar_candidates(rgb_image, cascade):
+            # dlib needs a contiguous buffer, not a strided view
+            crop = np.ascontiguousarray(rgb_image[top:bottom, left:right])
+            for c_top, c_right, c_bottom, c_left in detect_faces(crop, max_dimension, upsample, model):
+                locations.append((c_top + top, c_right + left, c_bottom + top, c_left + left))
+        return locations
+
+    height, width = rgb_image.shape[:2]
+    small, scale = _resize_to(rgb_image, max_dimension)
+    locations = face_recognition.face_locations(small, number_of_times_to_upsample=upsample, model=model)
+    if scale == 1.0:
+        return locations
+    return [_scale_location(location, scale, height, width) for location in locations]
+
@@ -0,0 +1,488 @@
+import json
+import threading
+import numpy as np
+
+ENCODING_DIM = 128
+ENCODING_DTYPE = np.dtype('<f4')  # Little-endian float32, 512 bytes per encoding
+MATRIX_BLOCK_ELEMENTS = 16 * 1024 * 1024  # Cap on float32 cells per batched distance block
+
+# Case.status values stored as one byte per row
+STATUS_CODES = {'missing': 0, 'found': 1}
+ACTIVE_STATUS = STATUS_CODES['missing']
+
+
+def status_code(status):
+    return STATUS_CODES.get(status, STATUS_CODES['missing'])
+
+
+def encoding_to_bytes(encoding):
+    """Pack an encoding into the raw bytes stored in Photo.face_encoding_blob."""
+    return np.asarray(encoding, dtype=ENCODING_DTYPE).tobytes()
+
+
+def encoding_from_bytes(blob):
+    return np.frombuffer(blob, dtype=ENCODING_DTYPE)
+
+
+def decode_photo_encoding(face_encoding_blob, face_encoding=None):
+    """
+    Return a photo's encoding, preferring the binary column and falling back to
+    the legacy JSON text for rows that have not been migrated yet.
+    """
+    if face_encoding_blob:
+        return encoding_from_bytes(face_encoding_blob)
+    if face_encoding:
+        return np.asarray(json.loads(face_encoding), dtype=np.float32)
+    return None
+
+
+class FaceGallery:
+    """
+    In-memory index of known face encodings.
+
+    Encodings live in one preallocated, contiguous float32 matrix together with
+    their precomputed squared norms, so a scan is a single matrix-vector product
+    over the filled rows instead of rebuilding an array from a Python list.
+    Rows are keyed by Photo.id so single photos can be added, replaced or
+    removed without reloading the whole gallery.
+
+    Metadata is kept as parallel numpy arrays (photo id, case id, status code)
+    rather than ORM objects; callers look up display fields by primary key
+    once a match has been found.
+
+    Rows are partitioned by status: photos of cases still missing occupy
+    rows [0, active_size) and archived (found) cases follow them. Default
+    scans only touch the active partition, and moving a case between
+    partitions is a row swap per photo.
+
+    Large galleries can opt into an approximate index with enable_ann(); the
+    row-to-list assignment it needs is kept here, parallel to the other arrays.
+    Training and the initial assignment happen in prepare_ann() on the writer
+    side and travel with the exported arrays, so scans never train.
+    """
+
+    # Arrays that make up the gallery state, in snapshot order
+    ARRAY_NAMES = ('encodings', 'sq_norms', 'photo_ids', 'case_ids', 'statuses')
+    # ANN state exported alongside them: list per row, and the (n_lists, dim) centroids
+    ANN_ARRAY_NAMES = ('lists', 'centroids')
+
+    def __init__(self, capacity=1024, dim=ENCODING_DIM):
+        self.dim = dim
+        self._lock = threading.RLock()
+        self._size = 0
+        self._active = 0  # Rows [0, _active) belong to active cases
+        self._rows = {}  # Photo.id -> row index, built lazily after attach()
+        self._cases = {}  # Case.id -> set of row indices, built lazily after attach()
+        self._groups = {}  # Row limit -> rows grouped by case, rebuilt lazily after changes
+        self._readonly = False
+        self.ann = None
+        self.ann_min_size = 0
+        self._lists = None  # ANN list per row, assigned lazily
+        self._allocate(max(int(capacity), 1))
+
+    def _allocate(self, capacity):
+        encodings = np.zeros((capacity, self.dim), dtype=np.float32)
+        sq_norms = np.zeros(capacity, dtype=np.float32)
+        photo_ids = np.zeros(capacity, dtype=np.int64)
+        case_ids = np.zeros(capacity, dtype=np.int64)
+        statuses = np.zeros(capacity, dtype=np.int8)
+        n = self._size
+        if n:
+            encodings[:n] = self._encodings[:n]
+            sq_norms[:n] = self._sq_norms[:n]
+            photo_ids[:n] = self._photo_ids[:n]
+            case_ids[:n] = self._case_ids[:n]
+            statuses[:n] = self._statuses[:n]
+        self._encodings = encodings
+        self._sq_norms = sq_norms
+        self._photo_ids = photo_ids
+        self._case_ids = case_ids
+        self._statuses = statuses
+        if self._lists is not None:
+            lists = np.zeros(capacity, dtype=np.int32)
+            lists[:n] = self._lists[:n]
+            self._lists = lists
+        # Scratch buffers reused by every scan so matching allocates nothing
+        self._scratch = np.empty(capacity, dtype=np.float32)
+        self._grouped_scratch = np.empty(capacity, dtype=np.float32)
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, photo_id):
+        with self._lock:
+            return photo_id in self._row_map()
+
+    @property
+    def capacity(self):
+        return self._encodings.shape[0]
+
+    @property
+    def active_size(self):
+        return self._active
+
+    def clear(self):
+        with self._lock:
+            self._size = 0
+            self._active = 0
+            self._rows = {}
+            self._cases = {}
+            self._groups = {}
+            self._lists = None
+            if self._readonly:
+                self._readonly = False
+                self._allocate(1024)
+
+    def export_arrays(self):
+        """
+        Copy the filled part of every state array, e.g. for writing a snapshot.
+        ANN training and list assignment are brought up to date first, so the
+        exported 'lists' and 'centroids' are ready to serve; both are empty
+        when the gallery is searched exactly.
+        """
+        with self._lock:
+            self.prepare_ann()
+            n = self._size
+            arrays = {name: getattr(self, '_' + name)[:n].copy() for name in self.ARRAY_NAMES}
+            if self._lists is not None:
+                arrays['lists'] = self._lists[:n].copy()
+                arrays['centroids'] = np.array(self.ann.centroids, dtype=np.float32)
+            else:
+                arrays['lists'] = np.zeros(0, dtype=np.int32)
+                arrays['centroids'] = np.zeros((0, self.dim), dtype=np.float32)
+            return arrays
+
+    @property
+    def ann_trained_size(self):
+        """Gallery size the exported centroids were trained at (0 without ANN state)."""
+        return self.ann.trained_size if self._lists is not None else 0
+
+    def attach(self, arrays, ann_trained_size=0):
+        """
+        Serve from externally owned arrays (for example read-only memory maps)
+        without copying them. The first mutation copies them into private
+        buffers, so the backing storage is never written to. ANN 'lists' and
+        'centroids' from export_arrays() are attached too, when present.
+        """
+        encodings = arrays['encodings']
+        if encodings.ndim != 2 or encodings.shape[1] != self.dim:
+            raise ValueError(f"Expected an (n, {self.dim}) encodings matrix, got {encodings.shape}")
+        n = encodings.shape[0]
+        if any(len(arrays[name]) != n for name in self.ARRAY_NAMES):
+            raise ValueError('Gallery arrays have mismatched lengths')
+        active = arrays['statuses'] == ACTIVE_STATUS
+        n_active = int(np.count_nonzero(active))
+        lists = arrays.get('lists')
+        centroids = arrays.get('centroids')
+        has_ann = lists is not None and centroids is not None and len(centroids) > 0 and len(lists) == n
+        if not active[:n_active].all():
+            # Not laid out active-first (e.g. written by an older version): reorder privately
+            order = np.argsort(~active, kind='stable')
+            arrays = {name: np.ascontiguousarray(arrays[name][order]) for name in self.ARRAY_NAMES}
+            if has_ann:
+                lists = np.ascontiguousarray(lists[order])
+        with self._lock:
+            for name in self.ARRAY_NAMES:
+                setattr(self, '_' + name, arrays[name])
+            self._size = n
+            self._active = n_active
+            self._rows = None
+            self._cases = None
+            self._groups = {}
+            self._lists = None
+            if has_ann and self.ann is not None:
+                self.ann.centroids = centroids
+                self.ann.trained_size = ann_trained_size
+                self._lists = lists
+            self._readonly = True
+            self._scratch = np.empty(max(n, 1), dtype=np.float32)
+            self._grouped_scratch = np.empty(max(n, 1), dtype=np.float32)
+
+    def _row_map(self):
+        if self._rows is None:
+            self._rows = {int(photo_id): row for row, photo_id in enumerate(self._photo_ids[:self._size])}
+        return self._rows
+
+    def _case_index(self):
+        if self._cases is None:
+            cases = {}
+            for row, case_id in enumerate(self._case_ids[:self._size].tolist()):
+                cases.setdefault(case_id, set()).add(row)
+            self._cases = cases
+        return self._cases
+
+    def _index_case_row(self, row, old_case_id, case_id):
+        """Move `row` between cases in the case index, if it has been built."""
+        if self._cases is None or old_case_id == case_id:
+            return
+        if old_case_id is not None:
+            rows = self._cases[old_case_id]
+            rows.discard(row)
+            if not rows:
+                del self._cases[old_case_id]
+        if case_id is not None:
+            self._cases.setdefault(case_id, set()).add(row)
+
+    def serves_from(self, arrays):
+        """True while the gallery is still backed by `arrays`, as passed to attach(), rather than private copies."""
+        return self._readonly and self._encodings is arrays['encodings']
+
+    def _ensure_writable(self):
+        if self._readonly:
+            self._readonly = False
+            self._allocate(max(self._size * 2, 1024))
+
+    def add(self, photo_id, case_id, encoding, status='missing'):
+        """
+        Insert the encoding for `photo_id`, replacing it in place if the photo
+        is already indexed. Returns the row index.
+        """
+        vector = np.asarray(encoding, dtype=np.float32).reshape(self.dim)
+        with self._lock:
+            self._ensure_writable()
+            rows = self._row_map()
+            row = rows.get(photo_id)
+            if row is None:
+                if self._size == self.capacity:
+                    self._allocate(self.capacity * 2)
+                # New rows start at the end of the archived partition
+                row = self._size
+                self._size += 1
+                rows[photo_id] = row
+                self._photo_ids[row] = photo_id
+                self._statuses[row] = STATUS_CODES['found']
+                old_case_id = None
+            else:
+                old_case_id = int(self._case_ids[row])
+            self._groups = {}
+            self._case_ids[row] = case_id
+            self._index_case_row(row, old_case_id, int(case_id))
+            self._encodings[row] = vector
+            self._sq_norms[row] = np.dot(vector, vector)
+            if self._lists is not None:
+                self._lists[row] = self.ann.assign(vector[None, :])[0]
+            return self._set_row_status(row, status_code(status))
+
+    def remove(self, photo_id):
+        """Drop `photo_id` from the gallery. Returns False if it was not indexed."""
+        with self._lock:
+            rows = self._row_map()
+            if photo_id not in rows:
+                return False
+            self._ensure_writable()
+            self._groups = {}
+            # Move the row to the start of the archived partition, then swap it
+            # with the last row so both partitions stay dense
+            row = self._set_row_status(rows[photo_id], STATUS_CODES['found'])
+            last = self._size - 1
+            self._swap_rows(row, last)
+            del rows[photo_id]
+            self._index_case_row(last, int(self._case_ids[last]), None)
+            self._size -= 1
+            return True
+
+    def remove_many(self, photo_ids):
+        with self._lock:
+            return sum(1 for photo_id in photo_ids if self.remove(photo_id))
+
+    def _swap_rows(self, a, b):
+        if a == b:
+            return
+        case_a, case_b = int(self._case_ids[a]), int(self._case_ids[b])
+        pair = [a, b]
+        for name in self.ARRAY_NAMES:
+            array = getattr(self, '_' + name)
+            array[pair] = array[pair[::-1]]
+        if self._lists is not None:
+            self._lists[pair] = self._lists[pair[::-1]]
+        rows = self._row_map()
+        rows[int(self._photo_ids[a])] = a
+        rows[int(self._photo_ids[b])] = b
+        if case_a != case_b:
+            self._index_case_row(a, case_a, case_b)
+            self._index_case_row(b, case_b, case_a)
+
+    def _set_row_status(self, row, code):
+        """Give `row` a new status code, moving it across the partition boundary if needed."""
+        was_active = row < self._active
+        self._statuses[row] = code
+        if code == ACTIVE_STATUS and not was_active:
+            self._swap_rows(row, self._active)
+            row = self._active
+            self._active += 1
+        elif code != ACTIVE_STATUS and was_active:
+            self._active -= 1
+            self._swap_rows(row, self._active)
+            row = self._active
+        return row
+
+    def case_rows(self, case_id):
+        """Row indices currently holding photos of `case_id`, in ascending order."""
+        with self._lock:
+            return np.array(sorted(self._case_index().get(case_id, ())), dtype=np.intp)
+
+    def set_case_status(self, case_id, status, in_place=False):
+        """
+        Move every photo of `case_id` into the partition for `status`. Only
+        the case's rows and the rows they swap with at the partition boundary
+        are written. With `in_place`, attached arrays are written directly
+        instead of being copied first; the caller must have made them
+        writable and keeps other readers of them consistent.
+        """
+        with self._lock:
+            photo_ids = self._photo_ids[self.case_rows(case_id)]
+            if not len(photo_ids):
+                return
+            if not in_place:
+                self._ensure_writable()
+            self._groups = {}
+            code = status_code(status)
+            rows = self._row_map()
+            for photo_id in photo_ids:
+                self._set_row_status(rows[int(photo_id)], code)
+
+    def enable_ann(self, index, min_size=50000):
+        """
+        Route top_cases() through the approximate `index` once the gallery
+        holds at least `min_size` encodings; smaller galleries stay exact.
+        """
+        with self._lock:
+            self.ann = index
+            self.ann_min_size = min_size
+            self._lists = None
+
+    def prepare_ann(self):
+        """
+        Train the ANN index if the gallery has outgrown it and assign every
+        row to a list. Writers call this (through export_arrays) before
+        publishing; scans only use the result. Returns True if ANN state is ready.
+        """
+        with self._lock:
+            n = self._size
+            if self.ann is None or n < self.ann_min_size or not n:
+                return False
+            if self.ann.needs_training(n):
+                self.ann.train(self._encodings[:n])
+                self._lists = None
+            if self._lists is None:
+                lists = np.zeros(self.capacity, dtype=np.int32)
+                lists[:n] = self.ann.assign(self._encodings[:n])
+                self._lists = lists
+            return True
+
+    def _ann_rows(self, encoding, limit):
+        """Candidate rows below `limit` from the ANN index, or None when the search should be exact."""
+        # Until a writer has run prepare_ann() an exact scan is cheaper than training here
+        if self.ann is None or limit < self.ann_min_size or self._lists is None:
+            return None
+        return self.ann.candidate_rows(encoding, self._lists[:limit])
+
+    def _scan_limit(self, include_archived):
+        return self._size if include_archived else self._active
+
+    def _distances(self, encoding, rows=None, limit=None):
+        # ||g - q||^2 = ||g||^2 - 2 g.q + ||q||^2, computed in the scratch buffer
+        query = np.asarray(encoding, dtype=np.float32).reshape(self.dim)
+        if rows is None:
+            limit = self._size if limit is None else limit
+            encodings = self._encodings[:limit]
+            sq_norms = self._sq_norms[:limit]
+        else:
+            encodings = self._encodings[rows]
+            sq_norms = self._sq_norms[rows]
+        out = self._scratch[:len(encodings)]
+        np.dot(encodings, query, out=out)
+        out *= -2.0
+        out += sq_norms
+        out += np.dot(query, query)
+        np.maximum(out, 0.0, out=out)
+        np.sqrt(out, out=out)
+        return out
+
+    @staticmethod
+    def _group_by_case(case_ids):
+        """Order that puts equal case ids next to each other, and where each run starts."""
+        order = np.argsort(case_ids, kind='stable')
+        sorted_ids = case_ids[order]
+        starts = np.flatnonzero(np.r_[True, sorted_ids[1:] != sorted_ids[:-1]])
+        return order, starts
+
+    def _case_groups(self, limit):
+        if limit not in self._groups:
+            self._groups[limit] = self._group_by_case(self._case_ids[:limit])
+        return self._groups[limit]
+
+    def top_cases(self, encoding, k=5, exact=False, include_archived=False):
+        """
+        Best `k` distinct cases for `encoding`, closest first, as a list of
+        (case_id, photo_id, distance). A case scores as its closest photo.
+        Only active cases are searched unless `include_archived` is set.
+        Uses the ANN index when one is enabled and the gallery is large
+        enough, unless `exact` is set.
+        """
+        with self._lock:
+            limit = self._scan_limit(include_archived)
+            if not limit or k < 1:
+                return []
+            rows = None if exact else self._ann_rows(encoding, limit)
+            if rows is None:
+                distances = self._distances(encoding, limit=limit)
+                order, starts = self._case_groups(limit)
+                grouped = np.take(distances, order, out=self._grouped_scratch[:len(distances)])
+            else:
+                if not len(rows):
+                    return []
+                distances = self._distances(encoding, rows)
+                order, starts = self._group_by_case(self._case_ids[rows])
+                grouped = distances[order]
+            case_best = np.minimum.reduceat(grouped, starts)
+            return self._rank_cases(distances, case_best, order, starts, k, rows)
+
+    def _rank_cases(self, distances, case_best, order, starts, k, rows=None):
+        """Turn per-case best distances into the top-k (case_id, photo_id, distance) list."""
+        k = min(k, len(starts))
+        top = np.argpartition(case_best, k - 1)[:k]
+        top = top[np.argsort(case_best[top])]
+
+        ends = np.append(starts[1:], len(distances))
+        results = []
+        for group in top:
+            members = order[starts[group]:ends[group]]
+            best = members[np.argmin(distances[members])]
+            row = best if rows is None else rows[best]
+            results.append((int(self._case_ids[row]), int(self._photo_ids[row]), float(distances[best])))
+        return results
+
+    def top_cases_many(self, encodings, k=5, exact=False, include_archived=False):
+        """
+        top_cases() for several probe encodings at once, e.g. every face in a
+        crowd photo. Distances for all probes come from one matrix-matrix
+        product; returns one ranked list per probe.
+        """
+        queries = np.asarray(encodings, dtype=np.float32).reshape(-1, self.dim)
+        with self._lock:
+            limit = self._scan_limit(include_archived)
+            if not len(queries):
+                return []
+            if not limit or k < 1:
+                return [[] for _ in queries]
+            if not exact and self._ann_rows(queries[0], limit) is not None:
+                # Each probe visits different inverted lists, so search them one by one
+                return [self.top_cases(query, k, include_archived=include_archived) for query in queries]
+
+            order, starts = self._case_groups(limit)
+            results = []
+            # Bound the (probes x gallery) distance block to ~64 MB
+            chunk = max(1, MATRIX_BLOCK_ELEMENTS // limit)
+            for first in range(0, len(queries), chunk):
+                block = queries[first:first + chunk]
+                distances = block @ self._encodings[:limit].T
+                distances *= -2.0
+                distances += self._sq_norms[:limit]
+                distances += np.einsum('ij,ij->i', block, block)[:, None]
+                np.maximum(distances, 0.0, out=distances)
+                np.sqrt(distances, out=distances)
+                case_best = np.minimum.reduceat(distances[:, order], starts, axis=1)
+                for i in range(len(block)):
+                    results.append(self._rank_cases(distances[i], case_best[i], order, starts, k))
+            return results
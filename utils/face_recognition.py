@@ -1,43 +1,127 @@
+"""
+Matching library: encode images once, then match the resulting vectors
+against a FaceGallery or any array of known encodings.
+
+Every function that takes a face also accepts a precomputed encoding (or a
+list/array of them), so callers that already hold vectors never pay for
+dlib again.
+"""
+import logging
 import cv2
 import numpy as np
 import face_recognition
-import base64
+
+from utils.face_detection import detect_faces
+from utils.face_gallery import ENCODING_DIM, FaceGallery
+from utils.image_io import decode_image
+
+logger = logging.getLogger(__name__)
 
 # Helper to load image from file path or numpy array
 def load_image(image):
     if isinstance(image, str):
         # Assume it's a file path
         return face_recognition.load_image_file(image)
+    elif isinstance(image, (bytes, bytearray, memoryview)):
+        rgb_image = decode_image(bytes(image))
+        if rgb_image is None:
+            raise ValueError('Could not decode image bytes')
+        return rgb_image
     elif isinstance(image, np.ndarray):
         # Convert BGR (OpenCV) to RGB
         return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
     else:
         raise ValueError('Unsupported image format for face recognition')
 
+def is_encoding(value):
+    """True for one face encoding or a stack of them, as opposed to an image."""
+    if isinstance(value, (list, tuple)):
+        if not value:
+            return False
+        try:
+            value = np.asarray(value)
+        except ValueError:  # Ragged, so not a stack of encodings
+            return False
+    if not isinstance(value, np.ndarray) or not np.issubdtype(value.dtype, np.floating):
+        return False
+    return value.shape[-1:] == (ENCODING_DIM,) and value.ndim in (1, 2)
+
+def encode(image, **detection):
+    """
+    Face encodings (an (n, 128) float32 array) for every face in `image`: a
+    file path, encoded bytes, or a BGR array. Encodings are passed through
+    unchanged. `detection` goes to utils.face_detection.detect_faces.
+    """
+    if is_encoding(image):
+        return np.atleast_2d(np.asarray(image, dtype=np.float32))
+    rgb_image = load_image(image)
+    locations = detect_faces(rgb_image, **detection)
+    if not locations:
+        return np.empty((0, ENCODING_DIM), dtype=np.float32)
+    return np.asarray(face_recognition.face_encodings(rgb_image, locations), dtype=np.float32)
+
+def match_many(vectors, gallery, k=5, labels=None, include_archived=False):
+    """
+    Ranked matches for each vector, in one batched distance computation.
+
+    With a FaceGallery, each result list holds (case_id, photo_id, distance)
+    for the k closest cases, found cases included if `include_archived`.
+    With an array of known encodings, it holds (label, row, distance) for
+    the k closest rows, where label comes from `labels` (default: the row
+    index).
+    """
+    if isinstance(vectors, (list, tuple, np.ndarray)) and not len(vectors):
+        return []  # No probes; encode() would take an empty list for an image
+    vectors = encode(vectors)
+    if isinstance(gallery, FaceGallery):
+        return gallery.top_cases_many(vectors, k, include_archived=include_archived)
+    known = np.atleast_2d(np.asarray(gallery, dtype=np.float32))
+    if not len(known) or not len(vectors):
+        return [[] for _ in vectors]
+    # ||a - b||^2 = ||a||^2 - 2ab + ||b||^2, for all pairs at once
+    distances = np.einsum('ij,ij->i', vectors, vectors)[:, None] - 2.0 * (vectors @ known.T)
+    distances += np.einsum('ij,ij->i', known, known)[None, :]
+    np.maximum(distances, 0.0, out=distances)
+    np.sqrt(distances, out=distances)
+    k = min(k, len(known))
+    results = []
+    for row_distances in distances:
+        nearest = np.argpartition(row_distances, k - 1)[:k]
+        nearest = nearest[np.argsort(row_distances[nearest], kind='stable')]
+        results.append([(labels[i] if labels is not None else int(i), int(i), float(row_distances[i]))
+                        for i in nearest])
+    return results
+
+def match(vector, gallery, k=5, labels=None, include_archived=False):
+    """Ranked matches for one face (the first, if given an image); see match_many."""
+    if isinstance(vector, (list, tuple, np.ndarray)) and not len(vector):
+        return []
+    vectors = encode(vector)
+    if not len(vectors):
+        return []
+    return match_many(vectors[:1], gallery, k, labels, include_archived)[0]
+
 def compare_faces(img1, img2, tolerance=0.6):
     """
-    Compare two images (numpy arrays or file paths). Returns (is_match, accuracy_score).
+    Compare two faces, each an image (numpy array, bytes or file path) or a
+    precomputed encoding. Returns (is_match, accuracy_score).
     accuracy_score is 1.0 for perfect match, 0.0 for no match, or a value based on face distance.
     """
     try:
-        image1 = load_image(img1)
-        image2 = load_image(img2)
-
-        # Get face encodings
-        encodings1 = face_recognition.face_encodings(image1)
-        encodings2 = face_recognition.face_encodings(image2)
+        encodings1 = encode(img1)
+        encodings2 = encode(img2)
 
-        if not encodings1 or not encodings2:
-            print('No face found in one of the images')
+        if not len(encodings1) or not len(encodings2):
+            logger.info('No face found in one of the images')
             return False, 0.0  # No face found in one of the images
 
         # Compute face distance
-        face_distance = face_recognition.face_distance([encodings1[0]], encodings2[0])[0]
+        face_distance = float(np.linalg.norm(encodings1[0] - encodings2[0]))
         is_match = face_distance <= tolerance
         # Convert distance to accuracy (1.0 = perfect match, 0.0 = worst)
         accuracy = max(0.0, 1.0 - face_distance)
-        print(f"Face distance: {face_distance:.3f}, Match: {is_match}, Accuracy: {accuracy:.3f}, Tolerance: {tolerance}")
+        logger.debug(f"Face distance: {face_distance:.3f}, Match: {is_match}, Accuracy: {accuracy:.3f}, Tolerance: {tolerance}")
         return is_match, accuracy
     except Exception as e:
-        print(f"Error in compare_faces: {e}")
-        return False, 0.0 
\ No newline at end of file
+        logger.error(f"Error in compare_faces: {e}")
+        return False, 0.0
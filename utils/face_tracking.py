@@ -0,0 +1,124 @@
+import threading
+import time
+
+# Minimum intersection-over-union for a face box to count as the same face as the previous frame
+MIN_OVERLAP = 0.6
+# Face distance below which an identity is trusted enough to be carried to the next frames
+CONFIDENT_DISTANCE = 0.35
+# Frames a track's identity is reused before the face is re-encoded anyway
+MAX_REUSE = 10
+# Seconds of silence after which a session's tracks are forgotten
+SESSION_TTL = 30
+MAX_SESSIONS = 1000
+
+
+def box_overlap(a, b):
+    """Intersection over union of two (top, right, bottom, left) boxes."""
+    height = min(a[2], b[2]) - max(a[0], b[0])
+    width = min(a[1], b[1]) - max(a[3], b[3])
+    if height <= 0 or width <= 0:
+        return 0.0
+    intersection = height * width
+    area_a = (a[2] - a[0]) * (a[1] - a[3])
+    area_b = (b[2] - b[0]) * (b[1] - b[3])
+    return intersection / float(area_a + area_b - intersection)
+
+
+def best_overlap(box, boxes, min_overlap=MIN_OVERLAP):
+    """Index of the box in `boxes` overlapping `box` the most, if by at least `min_overlap`; else None."""
+    best, best_index = min_overlap, None
+    for i, other in enumerate(boxes):
+        overlap = box_overlap(box, other)
+        if overlap >= best:
+            best, best_index = overlap, i
+    return best_index
+
+
+class Track:
+    """One face followed across a session's frames, with the identity last matched to it."""
+
+    def __init__(self, box, case_id, distance):
+        self.box = box
+        self.case_id = case_id
+        self.distance = distance
+        self.reused = 0
+
+    @property
+    def confident(self):
+        return self.case_id is not None and self.distance <= CONFIDENT_DISTANCE
+
+
+class FaceTracker:
+    """
+    Short-lived per-session face tracks for continuous recognition. A face
+    whose box barely moved since the last frame, and whose identity was
+    confident, keeps that identity without being encoded again; new, moved
+    or uncertain faces are encoded and matched as usual.
+
+    State lives in this process only, so with several server processes a
+    session that lands on another one simply starts a fresh track.
+    """
+
+    def __init__(self, min_overlap=MIN_OVERLAP, max_reuse=MAX_REUSE, ttl=SESSION_TTL, max_sessions=MAX_SESSIONS):
+        self.min_overlap = min_overlap
+        self.max_reuse = max_reuse
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._sessions = {}  # session key -> (last seen, [Track])
+        self._lock = threading.Lock()
+
+    def reusable(self, key):
+        """
+        The session's tracks whose identity may be carried to the next frame.
+        Pass their boxes to the encoder so matching faces are not re-encoded,
+        then hand the same list back to update().
+        """
+        with self._lock:
+            entry = self._sessions.get(key)
+            if entry is None or time.monotonic() - entry[0] > self.ttl:
+                return []
+            return [track for track in entry[1] if track.confident and track.reused < self.max_reuse]
+
+    def update(self, key, locations, encodings, reusable, match):
+        """
+        Assign this frame's faces to tracks and return one Track per location.
+        `encodings` holds None for faces the encoder skipped because they
+        overlap a box in `reusable`; `match` maps a list of encodings to a
+        list of (case_id, distance), with case_id None for no match.
+        """
+        boxes = [track.box for track in reusable]
+        tracks = [None] * len(locations)
+        pending = []
+        for i, (location, encoding) in enumerate(zip(locations, encodings)):
+            if encoding is None:
+                index = best_overlap(location, boxes, self.min_overlap)
+                if index is not None:
+                    previous = reusable[index]
+                    tracks[i] = Track(location, previous.case_id, previous.distance)
+                    tracks[i].reused = previous.reused + 1
+                    continue
+            pending.append(i)
+        encoded = [i for i in pending if encodings[i] is not None]
+        if encoded:
+            for i, (case_id, distance) in zip(encoded, match([encodings[i] for i in encoded])):
+                tracks[i] = Track(locations[i], case_id, distance)
+        for i in pending:
+            if tracks[i] is None:  # Skipped by the encoder but no longer matches a reusable track
+                tracks[i] = Track(locations[i], None, float('inf'))
+
+        now = time.monotonic()
+        with self._lock:
+            self._sessions[key] = (now, tracks)
+            if len(self._sessions) > self.max_sessions:
+                self._expire(now)
+        return tracks
+
+    def _expire(self, now):
+        stale = [key for key, (seen, _) in self._sessions.items() if now - seen > self.ttl]
+        for key in stale:
+            del self._sessions[key]
+        # Still full of live sessions: drop the least recently seen
+        overflow = len(self._sessions) - self.max_sessions
+        if overflow > 0:
+            for key in sorted(self._sessions, key=lambda k: self._sessions[k][0])[:overflow]:
+                del self._sessions[key]
@@ -0,0 +1,98 @@
+import glob
+import json
+import os
+import uuid
+import numpy as np
+
+from utils.face_gallery import FaceGallery
+
+SNAPSHOT_DIR = 'data/encodings'
+MANIFEST_NAME = 'gallery_manifest.json'
+FORMAT_VERSION = 2  # 2: ANN lists and centroids are part of the snapshot
+
+
+def _array_path(directory, generation, name):
+    return os.path.join(directory, f'gallery-{generation}-{name}.npy')
+
+
+def _fsync_write(path, write):
+    with open(path, 'wb') as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def save_snapshot(gallery, directory=SNAPSHOT_DIR, fingerprint=None):
+    """
+    Write the gallery to `directory` as one .npy file per array plus a JSON
+    manifest. Array files carry a fresh generation id and the manifest is
+    swapped in with os.replace, so readers always see a complete snapshot.
+    Returns the new generation id.
+    """
+    os.makedirs(directory, exist_ok=True)
+    # Exporting also trains and assigns the ANN lists, so readers never have to
+    arrays = gallery.export_arrays()
+    generation = uuid.uuid4().hex
+
+    for name, array in arrays.items():
+        _fsync_write(_array_path(directory, generation, name), lambda f, a=array: np.save(f, a))
+
+    manifest = {
+        'format_version': FORMAT_VERSION,
+        'generation': generation,
+        'dim': gallery.dim,
+        'count': len(arrays['photo_ids']),
+        'ann_trained_size': gallery.ann_trained_size,
+        'fingerprint': fingerprint,
+    }
+    manifest_path = os.path.join(directory, MANIFEST_NAME)
+    tmp_path = f'{manifest_path}.{generation}.tmp'
+    _fsync_write(tmp_path, lambda f: f.write(json.dumps(manifest).encode('utf-8')))
+    os.replace(tmp_path, manifest_path)
+
+    # Older generations are no longer referenced; processes that already mapped
+    # them keep their view until they reload.
+    for path in glob.glob(os.path.join(directory, 'gallery-*.npy')):
+        if f'gallery-{generation}-' not in os.path.basename(path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass  # Still mapped (Windows) or already removed by another worker
+    return generation
+
+
+def read_manifest(directory=SNAPSHOT_DIR):
+    try:
+        with open(os.path.join(directory, MANIFEST_NAME), 'r') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get('format_version') != FORMAT_VERSION:
+        return None
+    return manifest
+
+
+def _load_array(path):
+    try:
+        return np.load(path, mmap_mode='r')
+    except ValueError:  # Zero-length arrays cannot be memory-mapped
+        return np.load(path)
+
+
+def load_snapshot(directory=SNAPSHOT_DIR):
+    """
+    Memory-map the current snapshot read-only. Returns (arrays, manifest), or
+    None if there is no usable snapshot.
+    """
+    manifest = read_manifest(directory)
+    if manifest is None:
+        return None
+    try:
+        arrays = {}
+        for name in FaceGallery.ARRAY_NAMES + FaceGallery.ANN_ARRAY_NAMES:
+            arrays[name] = _load_array(_array_path(directory, manifest['generation'], name))
+    except (OSError, ValueError):
+        return None
+    if any(len(arrays[name]) != manifest['count'] for name in FaceGallery.ARRAY_NAMES):
+        return None
+    return arrays, manifest
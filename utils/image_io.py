@@ -0,0 +1,93 @@
+import io
+import os
+import uuid
+import numpy as np
+from PIL import Image, ImageOps
+
+# Largest image (in pixels, after any reduced-resolution decode) we are willing to hold in memory
+MAX_DECODE_PIXELS = 40_000_000
+# EXIF orientations that rotate the image by 90 degrees, swapping width and height
+ORIENTATION_TAG = 0x0112
+TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+
+
+def _open_reduced(data, max_dimension=None):
+    """
+    Open `data` with Pillow, asking the JPEG decoder for the smallest DCT
+    scale (1/2, 1/4 or 1/8) that keeps the longest side at least
+    `max_dimension`, so a 12 MP photo never exists in memory at full size.
+    EXIF orientation is applied. Returns (image, (height, width) of the
+    upright full-size original), or (None, None) for unreadable or oversized
+    images.
+    """
+    try:
+        image = Image.open(io.BytesIO(data))
+        width, height = image.size
+        if max_dimension and image.format == 'JPEG':
+            # Request the aspect ratio of the photo, not a square: for a square request
+            # the decoder keeps the *shorter* side above max_dimension
+            longest = float(max(width, height))
+            image.draft('RGB', (max(1, int(width * max_dimension / longest)),
+                                max(1, int(height * max_dimension / longest))))
+        if image.size[0] * image.size[1] > MAX_DECODE_PIXELS:
+            return None, None
+        if image.getexif().get(ORIENTATION_TAG) in TRANSPOSED_ORIENTATIONS:
+            width, height = height, width
+        image = ImageOps.exif_transpose(image)
+        return image.convert('RGB'), (height, width)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None, None
+
+
+def decode_image_reduced(data, max_dimension=None):
+    """
+    Decode JPEG/PNG bytes straight from memory to an upright RGB array,
+    reduced as in decode_image. Returns (array, (height, width) of the full
+    size original), so coordinates found in the array can be mapped back to
+    the uploaded image; (None, None) if unreadable.
+    """
+    image, original_shape = _open_reduced(data, max_dimension)
+    if image is None:
+        return None, None
+    return np.asarray(image), original_shape
+
+
+def decode_image(data, max_dimension=None):
+    """
+    Decode JPEG/PNG bytes straight from memory to an upright RGB array, or
+    None if unreadable. With `max_dimension`, JPEGs are decoded at reduced
+    resolution: the longest side ends up at least `max_dimension` and under
+    twice that (unless the photo is smaller). Other formats decode at full size.
+    """
+    return decode_image_reduced(data, max_dimension)[0]
+
+
+def make_thumbnail(data, max_dimension, quality=80):
+    """JPEG bytes of the image scaled so its longest side is at most `max_dimension`."""
+    image, _ = _open_reduced(data, max_dimension)
+    if image is None:
+        return None
+    image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+    output = io.BytesIO()
+    image.save(output, format='JPEG', quality=quality)
+    return output.getvalue()
+
+
+def atomic_write(path, data):
+    """
+    Write `data` to `path` through a temporary file in the same directory and
+    os.replace, so readers never see a partially written file.
+    """
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = os.path.join(directory, f'.{os.path.basename(path)}.{uuid.uuid4().hex[:8]}.tmp')
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
@@ -0,0 +1,124 @@
+import hashlib
+import os
+
+from utils.image_io import atomic_write, make_thumbnail
+
+PHOTO_DIR = 'data/faces'
+THUMBNAIL_DIR = 'thumbs'
+
+
+def content_hash(data):
+    """SHA-256 hex digest of an image's bytes; the key photos are stored under."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def _extension(data):
+    return '.png' if data[:8] == b'\x89PNG\r\n\x1a\n' else '.jpg'
+
+
+def _name_parts(name):
+    """Path components of a store name; ValueError for names that could leave the photo directory."""
+    parts = name.split('/')
+    if any(part in ('', '.', '..') or '\\' in part or '\0' in part for part in parts):
+        raise ValueError(f'Unsafe photo name: {name!r}')
+    return parts
+
+
+class PhotoStore:
+    """
+    Content-addressed photo storage. Every photo is stored once, named by the
+    SHA-256 of its bytes and sharded into two levels of subdirectories
+    (ab/cd/abcd....jpg) so no directory grows past a few thousand entries.
+
+    Photo.filename holds the name returned by put(); nothing outside this
+    class should build paths under the photo directory itself. Since a name
+    always refers to the same bytes, stored photos and their thumbnails can
+    be cached by clients indefinitely.
+    """
+
+    def __init__(self, root=PHOTO_DIR):
+        self.root = root
+
+    @staticmethod
+    def name_for(key, extension='.jpg'):
+        """Store name of the photo with content hash `key`."""
+        return f'{key[:2]}/{key[2:4]}/{key}{extension}'
+
+    def path(self, name):
+        """Filesystem path of a stored photo. Raises ValueError for names that are not store names."""
+        return os.path.join(self.root, *_name_parts(name))
+
+    def exists(self, name):
+        try:
+            return os.path.exists(self.path(name))
+        except ValueError:
+            return False
+
+    def put(self, data, key=None):
+        """Store `data` (if not already stored) and return its name."""
+        name = self.name_for(key or content_hash(data), _extension(data))
+        if not self.exists(name):
+            atomic_write(self.path(name), data)
+        return name
+
+    def put_file(self, source_path, key=None):
+        """
+        Move an existing file into the store and return its name. The source
+        is removed either way; when the content is already stored it is a
+        byte-identical duplicate.
+        """
+        with open(source_path, 'rb') as f:
+            head = f.read(8)
+            if key is None:
+                digest = hashlib.sha256(head)
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(chunk)
+                key = digest.hexdigest()
+        name = self.name_for(key, _extension(head))
+        target = self.path(name)
+        if os.path.exists(target):
+            os.remove(source_path)
+        else:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(source_path, target)
+        return name
+
+    @staticmethod
+    def key_of(name):
+        """Content hash a store name was derived from."""
+        return name.rsplit('/', 1)[-1].split('.', 1)[0]
+
+    def thumbnail_path(self, name, max_dimension):
+        """
+        Path of a JPEG variant of `name` no larger than `max_dimension`,
+        generating and caching it on first use. None if the photo is missing
+        or cannot be decoded.
+        """
+        thumb_name = f'{name.rsplit(".", 1)[0]}.jpg'
+        path = os.path.join(self.root, THUMBNAIL_DIR, str(max_dimension), *_name_parts(thumb_name))
+        if not os.path.exists(path):
+            try:
+                thumbnail = make_thumbnail(self.read(name), max_dimension)
+            except OSError:
+                return None
+            if thumbnail is None:
+                return None
+            atomic_write(path, thumbnail)
+        return path
+
+    def read(self, name):
+        with open(self.path(name), 'rb') as f:
+            return f.read()
+
+    def delete(self, name):
+        """Remove a stored photo and its thumbnails; callers check that no Photo still references it."""
+        paths = [self.path(name)]
+        thumbs_root = os.path.join(self.root, THUMBNAIL_DIR)
+        if os.path.isdir(thumbs_root):
+            thumb_name = f'{name.rsplit(".", 1)[0]}.jpg'
+            paths += [os.path.join(thumbs_root, size, *_name_parts(thumb_name)) for size in os.listdir(thumbs_root)]
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
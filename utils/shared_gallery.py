@@ -0,0 +1,370 @@
+import hashlib
+import os
+import struct
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+import numpy as np
+
+from utils.face_gallery import FaceGallery
+
+try:
+    import fcntl
+except ImportError:  # Windows: only the in-process lock is available
+    fcntl = None
+
+LOCK_PATH = 'data/encodings/gallery.lock'
+# Part of every segment name, so segments left in /dev/shm by an older layout are never attached
+LAYOUT_VERSION = 4
+
+# Control block: sequence counter (odd while a writer is mid-update), generation, data segment name
+_CONTROL = struct.Struct('<qq32s')
+# Data segment header: sequence counter (odd while rows are rewritten in place), row count,
+# dim, ANN centroid count, ANN trained size, fingerprint (three integers supplied by the publisher)
+_HEADER = struct.Struct('<qqqqqqqq')
+_SEQ = struct.Struct('<q')
+_FINGERPRINT = struct.Struct('<qqq')
+_FINGERPRINT_OFFSET = _HEADER.size - _FINGERPRINT.size
+_NO_FINGERPRINT = (-1, -1, -1)
+_ALIGN = 64
+
+_DTYPES = {
+    'encodings': np.float32,
+    'sq_norms': np.float32,
+    'photo_ids': np.int64,
+    'case_ids': np.int64,
+    'statuses': np.int8,
+    'lists': np.int32,
+    'centroids': np.float32,
+}
+_SEGMENT_ARRAYS = FaceGallery.ARRAY_NAMES + FaceGallery.ANN_ARRAY_NAMES
+
+
+# Python < 3.13 has no `track` flag and registers every segment it touches with
+# the resource tracker, which would unlink it when this process exits
+_HAS_TRACK_FLAG = sys.version_info >= (3, 13)
+_TRACKED = os.name == 'posix' and not _HAS_TRACK_FLAG
+if _TRACKED:
+    from multiprocessing import resource_tracker
+
+
+def _open_segment(name, create=False, size=0):
+    """
+    Open a shared memory segment that outlives this process. Segments are
+    unlinked explicitly by the publisher, never by Python's resource tracker.
+    """
+    if _HAS_TRACK_FLAG:
+        return shared_memory.SharedMemory(name=name, create=create, size=size, track=False)
+    segment = shared_memory.SharedMemory(name=name, create=create, size=size)
+    if _TRACKED:
+        resource_tracker.unregister(segment._name, 'shared_memory')
+    return segment
+
+
+def _unlink_segment(name):
+    try:
+        segment = _open_segment(name)
+    except FileNotFoundError:
+        return
+    if _TRACKED:
+        # unlink() unregisters the segment again, so hand it back to the tracker first
+        resource_tracker.register(segment._name, 'shared_memory')
+    segment.unlink()
+    segment.close()
+
+
+def _shapes(count, dim, n_centroids):
+    shapes = {name: (count,) for name in _SEGMENT_ARRAYS}
+    shapes['encodings'] = (count, dim)
+    shapes['lists'] = (count if n_centroids else 0,)
+    shapes['centroids'] = (n_centroids, dim)
+    return shapes
+
+
+def _layout(shapes):
+    """Byte offset of each array within a data segment, plus the total size."""
+    offsets = {}
+    offset = _ALIGN
+    for name in _SEGMENT_ARRAYS:
+        offsets[name] = offset
+        offset += int(np.prod(shapes[name])) * np.dtype(_DTYPES[name]).itemsize
+        offset = -(-offset // _ALIGN) * _ALIGN
+    return offsets, max(offset, _ALIGN)
+
+
+class SharedGallery:
+    """
+    Publishes a FaceGallery to every worker process on the host through
+    multiprocessing.shared_memory.
+
+    Each published state lives in its own data segment. A small control
+    segment holds the current generation and segment name; readers compare
+    the generation before scanning and re-attach when it has moved, so no
+    worker reloads from SQLite to see another worker's writes. Writers are
+    serialised with a file lock and always start from the latest generation.
+
+    Moving a case between partitions rewrites only the rows it swaps, in the
+    current segment. A sequence counter in the segment header tells readers
+    that scan through scan() to retry when rows changed under them.
+    """
+
+    def __init__(self, gallery, lock_path=LOCK_PATH):
+        self.gallery = gallery
+        self.lock_path = lock_path
+        namespace = hashlib.sha1(os.path.abspath(lock_path).encode('utf-8')).hexdigest()[:10]
+        self._prefix = f'mpf{LAYOUT_VERSION}{namespace}'
+        self._thread_lock = threading.RLock()
+        self._lock_depth = 0  # flock is not reentrant; nested _locked() calls reuse the outer lock
+        self._control = None
+        self._segment = None
+        self._arrays = None  # Views of the current segment, as attached to the gallery
+        self._seq = 0  # Segment sequence counter the gallery state was attached at
+        self._retired = []
+        self.generation = 0
+        self.fingerprint = None
+        self.available = True  # False once shared memory turns out to be unusable here
+
+    def _control_block(self):
+        if self._control is None:
+            name = f'{self._prefix}_ctl'
+            try:
+                self._control = _open_segment(name)
+            except FileNotFoundError:
+                try:
+                    self._control = _open_segment(name, create=True, size=_CONTROL.size)
+                    self._control.buf[:_CONTROL.size] = bytes(_CONTROL.size)
+                except FileExistsError:
+                    self._control = _open_segment(name)
+        return self._control
+
+    def _read_control(self):
+        """Consistent (generation, segment name) snapshot of the control block."""
+        buf = self._control_block().buf
+        for _ in range(10000):
+            seq, generation, name = _CONTROL.unpack_from(buf)
+            if seq % 2 == 0 and _CONTROL.unpack_from(buf)[0] == seq:
+                break
+        # A writer that died mid-update leaves the counter odd; its last values are still usable
+        return generation, name.rstrip(b'\0').decode('ascii')
+
+    def _write_control(self, generation, name):
+        buf = self._control_block().buf
+        seq = _CONTROL.unpack_from(buf)[0]
+        struct.pack_into('<q', buf, 0, seq + 1)
+        struct.pack_into('<q32s', buf, 8, generation, name.encode('ascii'))
+        struct.pack_into('<q', buf, 0, seq + 2)
+
+    @contextmanager
+    def _locked(self):
+        with self._thread_lock:
+            if fcntl is None or self._lock_depth:
+                self._lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth -= 1
+                return
+            os.makedirs(os.path.dirname(self.lock_path) or '.', exist_ok=True)
+            with open(self.lock_path, 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                self._lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth -= 1
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def refresh(self):
+        """
+        Attach the latest published generation if it is newer than ours.
+        Returns True if the gallery was replaced. Cheap enough to call per scan.
+        """
+        if not self.available:
+            return False
+        try:
+            generation, name = self._read_control()
+        except OSError:
+            self.available = False
+            return False
+        if generation == self.generation or not name:
+            return False
+        with self._thread_lock:
+            generation, name = self._read_control()
+            if generation == self.generation or not name:
+                return False
+            if self._segment is not None and name == self._segment.name:
+                # Rows were rewritten in place: re-read the partition boundary from the same segment
+                self._attach(self._segment, generation)
+                return True
+            try:
+                segment = _open_segment(name)
+            except FileNotFoundError:
+                return False  # Superseded while we looked; the next call picks up the newer one
+            self._attach(segment, generation)
+            return True
+
+    def _attach(self, segment, generation):
+        seq, count, dim, n_centroids, ann_trained_size, *fingerprint = _HEADER.unpack_from(segment.buf)
+        if segment is self._segment:
+            arrays = self._arrays
+        else:
+            shapes = _shapes(count, dim, n_centroids)
+            offsets, _ = _layout(shapes)
+            arrays = {}
+            for name in _SEGMENT_ARRAYS:
+                array = np.ndarray(shapes[name], dtype=_DTYPES[name], buffer=segment.buf, offset=offsets[name])
+                array.flags.writeable = False
+                arrays[name] = array
+        self.gallery.attach(arrays, ann_trained_size)
+        if segment is not self._segment:
+            self._retire(self._segment)
+        self._segment = segment
+        self._arrays = arrays
+        self._seq = seq
+        self.generation = generation
+        self.fingerprint = fingerprint
+
+    def scan(self, read, attempts=100):
+        """
+        Call `read()`, a search of the local gallery, on the latest generation
+        and return its result. The search is repeated if another process was
+        rewriting rows of the segment meanwhile; a writer that died mid-update
+        stops the retries after `attempts`.
+        """
+        for _ in range(attempts):
+            self.refresh()
+            with self._thread_lock:
+                segment = self._segment
+                seq = self._seq
+            if segment is None or not self.available:
+                return read()
+            if seq % 2 == 0 and _SEQ.unpack_from(segment.buf)[0] == seq:
+                result = read()
+                if _SEQ.unpack_from(segment.buf)[0] == seq:
+                    return result
+            time.sleep(0.001)  # Let the writer finish and publish its generation
+        return read()
+
+    def _retire(self, segment):
+        # A segment can only be closed once no numpy views of it remain
+        if segment is not None:
+            self._retired.append(segment)
+        still_mapped = []
+        for old in self._retired:
+            try:
+                old.close()
+            except BufferError:
+                still_mapped.append(old)
+        self._retired = still_mapped
+
+    def set_case_status(self, case_id, status, fingerprint=None):
+        """
+        Move a case's photos into the partition for `status` and publish the
+        change. When this worker serves from the current segment, only the
+        swapped rows and the header are rewritten in place; otherwise the
+        whole gallery is published, as writer() does. `fingerprint` may be a
+        callable evaluated after the update.
+        """
+        with self._locked():
+            self.refresh()
+            if not self.available or self._segment is None or not self.gallery.serves_from(self._arrays):
+                self.gallery.set_case_status(case_id, status)
+                self._publish(fingerprint() if callable(fingerprint) else fingerprint)
+                return
+            fingerprint = fingerprint() if callable(fingerprint) else fingerprint
+            buf = self._segment.buf
+            seq = _SEQ.unpack_from(buf)[0]
+            _SEQ.pack_into(buf, 0, seq + 1)
+            try:
+                for array in self._arrays.values():
+                    array.flags.writeable = True
+                self.gallery.set_case_status(case_id, status, in_place=True)
+            finally:
+                for array in self._arrays.values():
+                    array.flags.writeable = False
+                _FINGERPRINT.pack_into(buf, _FINGERPRINT_OFFSET, *(fingerprint or _NO_FINGERPRINT))
+                _SEQ.pack_into(buf, 0, seq + 2)
+                self._seq = seq + 2
+                self.fingerprint = list(fingerprint) if fingerprint is not None else None
+                # Same segment, new generation: readers re-read the partition boundary
+                generation = max(self._read_control()[0], self.generation) + 1
+                self._write_control(generation, self._segment.name)
+                self.generation = generation
+
+    def publish(self, fingerprint=None):
+        """Copy the local gallery into a new segment and make it the current generation."""
+        with self._locked():
+            self._publish(fingerprint)
+
+    def _publish(self, fingerprint):
+        # Attaching the published segment replaces this with the same value
+        self.fingerprint = list(fingerprint) if fingerprint is not None else None
+        if not self.available:
+            return
+        try:
+            self._publish_segment(fingerprint)
+        except OSError:
+            # e.g. no /dev/shm in this container: keep serving the local gallery
+            self.available = False
+
+    def _publish_segment(self, fingerprint):
+        # Exporting also trains and assigns the ANN lists, so readers never have to
+        arrays = self.gallery.export_arrays()
+        count = len(arrays['photo_ids'])
+        dim = self.gallery.dim
+        n_centroids = len(arrays['centroids'])
+        offsets, size = _layout(_shapes(count, dim, n_centroids))
+
+        name = f'{self._prefix}_{uuid.uuid4().hex[:12]}'
+        segment = _open_segment(name, create=True, size=size)
+        _HEADER.pack_into(segment.buf, 0, 0, count, dim, n_centroids, self.gallery.ann_trained_size,
+                          *(fingerprint or _NO_FINGERPRINT))
+        for array_name, array in arrays.items():
+            target = np.ndarray(array.shape, dtype=_DTYPES[array_name], buffer=segment.buf,
+                                offset=offsets[array_name])
+            target[...] = array
+            del target
+
+        previous_generation, previous_name = self._read_control()
+        generation = max(previous_generation, self.generation) + 1
+        self._write_control(generation, name)
+        if previous_name:
+            # Processes that already attached keep their mapping after unlink
+            _unlink_segment(previous_name)
+        # Serve from the shared copy too, so this worker drops its private buffers
+        self._attach(segment, generation)
+
+    @contextmanager
+    def exclusive(self):
+        """
+        Hold the writers' lock with the local gallery at the latest generation,
+        without publishing anything, e.g. to write a snapshot that no other
+        process is rewriting at the same time.
+        """
+        with self._locked():
+            self.refresh()
+            yield self.gallery
+
+    @contextmanager
+    def writer(self, fingerprint=None):
+        """
+        Exclusive update: brings the local gallery up to date, lets the caller
+        mutate it, then publishes the result. `fingerprint` may be a callable
+        evaluated after the update.
+        """
+        with self._locked():
+            self.refresh()
+            yield self.gallery
+            self._publish(fingerprint() if callable(fingerprint) else fingerprint)
+
+    def close(self):
+        with self._thread_lock:
+            self._retire(self._segment)
+            self._segment = None
+            self._arrays = None
+            if self._control is not None:
+                self._control.close()
+                self._control = None